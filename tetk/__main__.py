@@ -0,0 +1,10 @@
+"""Allows `python -m tetk build ...` from the repository root, see cli.py"""
+import sys
+from pathlib import Path
+
+# modules of tetk import each other by their flat names
+sys.path.insert(0, str(Path(__file__).parent))
+
+from cli import main  # noqa: E402
+
+sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Benchmark suite on synthetic wafer map corpora.
+
+    python -m tetk bench --sizes 100 1000 10000 100000
+    python -m tetk bench --startup
+    python -m tetk bench --sizes 1000 --backends xml pptx
+
+Corpora are generated once per size and seed under <user_wd>/benchmark-corpora,
+every run appends one JSON line per size to the results file so runs can be compared.
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import PIL.Image
+
+import perf
+from commons import get_time
+from reader import FileManager
+from makeppt import PptManager
+from utils import PathFinder
+
+
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000]
+TEMPS = ["25C", "110C"]
+WAFERS_PER_LOT = 25
+# modules the GUI should not import before the window shows
+HEAVY_MODULES = ["pandas", "numpy", "pptx", "PIL", "lxml"]
+STARTUP_SCRIPT = """
+import sys, json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.load_config()
+t2 = time.perf_counter()
+heavy = [x for x in %r if x in sys.modules]
+print("STARTUP " + json.dumps({"import_s": t1 - t0, "config_s": t2 - t1, "heavy": heavy}))
+""" % HEAVY_MODULES
+# pass, fail and marginal bins of the die map
+BIN_COLORS = np.array([[40, 170, 60], [210, 40, 40], [230, 200, 40]], dtype=np.uint8)
+
+
+def wafer_map(width: int, height: int, header_px: int, seed: int) -> bytes:
+    """
+    PNG of a synthetic wafer map, a round grid of coloured dies below a header band
+
+    :param width: image width in pixels
+    :type width: int
+    :param height: image height in pixels
+    :type height: int
+    :param header_px: height of the header band, cropped away by the default recipe
+    :type header_px: int
+    :param seed: random seed, each seed gives a different map
+    :type seed: int
+    :return: PNG bytes
+    :rtype: bytes
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    img[:header_px] = 200
+
+    size = min(width, height - header_px)
+    n_dies = 24
+    die_px = max(1, size // n_dies)
+    bins = rng.choice(3, size=(n_dies, n_dies), p=[0.85, 0.1, 0.05])
+    dies = np.kron(BIN_COLORS[bins], np.ones((die_px, die_px, 1), dtype=np.uint8))
+    yy, xx = np.mgrid[: dies.shape[0], : dies.shape[1]]
+    radius = dies.shape[0] / 2
+    outside = (yy - radius) ** 2 + (xx - radius) ** 2 > radius**2
+    dies[outside] = 255
+    img[header_px : header_px + dies.shape[0], : dies.shape[1]] = dies
+
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(img).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def corpus_paths(root: Path, n_images: int) -> list[Path]:
+    """File layout of a corpus, <temp>/<product>_<lot>_W-<wafer>.png"""
+    paths = []
+    per_temp = -(-n_images // len(TEMPS))
+    for temp in TEMPS:
+        for i in range(per_temp):
+            if len(paths) == n_images:
+                break
+            lot, wafer = divmod(i, WAFERS_PER_LOT)
+            paths.append(root / temp / f"BENCH_LOT{lot:05d}_W-{wafer + 1:02d}.png")
+    return paths
+
+
+def make_corpus(root: Path, n_images: int, image_size=(422, 477), seed: int = 0) -> Path:
+    """
+    Generates a synthetic input tree, reused if it was generated before
+
+    :param root: folder of the corpus
+    :type root: pathlib.Path
+    :param n_images: number of images
+    :type n_images: int
+    :param image_size: (width, height), as `original_image_size`, defaults to (422, 477)
+    :type image_size: tuple, optional
+    :param seed: random seed of the corpus, defaults to 0
+    :type seed: int, optional
+    :return: root
+    :rtype: pathlib.Path
+    """
+    marker = root / "corpus.json"
+    spec = {"n_images": n_images, "image_size": list(image_size), "seed": seed}
+    if marker.is_file() and json.loads(marker.read_text()) == spec:
+        return root
+    paths = corpus_paths(root, n_images)
+    for temp in TEMPS:
+        (root / temp).mkdir(parents=True, exist_ok=True)
+    width, height = image_size
+    header_px = max(0, height - width)
+
+    def write(i_path):
+        i, path = i_path
+        path.write_bytes(wafer_map(width, height, header_px, seed * 10_000_000 + i))
+
+    with ThreadPoolExecutor() as pool:
+        list(pool.map(write, enumerate(paths)))
+    marker.write_text(json.dumps(spec))
+    return root
+
+
+def timed(stages: dict, name: str, func, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    stages[f"{name}_s"] = round(time.perf_counter() - t0, 4)
+    return result
+
+
+def bench_corpus(cfg: dict, corpus: Path, n_images: int) -> dict:
+    """
+    Times the stages of a lot per page deck on one corpus
+
+    :return: stage timings in seconds, deck size and perf counters
+    :rtype: dict
+    """
+    stages = {}
+    perf.PERF.reset()
+    imgs = timed(stages, "pathfinder", PathFinder(corpus, scan_workers=cfg["scan_workers"]).get_image_files)
+    fmgr = timed(stages, "filetable", FileManager, cfg, corpus)
+    data = timed(stages, "group", fmgr.construct_lotPerPage)
+
+    ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+    t0 = time.perf_counter()
+    ppt.prepare_lots(data)
+    stages["prepare_s"] = round(time.perf_counter() - t0, 4)
+    t0 = time.perf_counter()
+    for name, imgpaths in data.items():
+        ppt.insert_images_wafersPerLot(name, imgpaths)
+    stages["insert_s"] = round(time.perf_counter() - t0, 4)
+    outpath = timed(stages, "save", ppt.save_ppt, f"benchmark-n{n_images}.pptx")
+
+    result = {
+        "n_images": n_images,
+        "n_found": len(imgs),
+        "n_pages": len(data),
+        "stages": stages,
+        "total_s": round(sum(stages.values()), 4),
+        "deck_bytes": outpath.stat().st_size,
+        "counters": perf.PERF.report()["counters"],
+    }
+    outpath.unlink()
+    return result
+
+
+def run(
+    cfg: dict,
+    sizes=None,
+    outpath: Path = None,
+    corpus_dir: Path = None,
+    seed: int = 0,
+    backends=None,
+):
+    """
+    Runs the benchmark at every size and appends the results as JSON lines
+
+    :param sizes: numbers of images, defaults to DEFAULT_SIZES
+    :type sizes: list, optional
+    :param backends: `picture_backend` values run one after the other on every corpus,
+        defaults to the recipe's
+    :type backends: list, optional
+    :param outpath: results file, defaults to benchmarks.jsonl in `outf02`
+    :type outpath: pathlib.Path, optional
+    :param corpus_dir: where corpora are generated, defaults to <user_wd>/benchmark-corpora
+    :type corpus_dir: pathlib.Path, optional
+    :return: results of this run
+    :rtype: list[dict]
+    """
+    log = cfg.log
+    sizes = sizes or DEFAULT_SIZES
+    backends = backends or [cfg["picture_backend"] if "picture_backend" in cfg else "xml"]
+    outpath = outpath or cfg.user_folders["outf02"] / "benchmarks.jsonl"
+    corpus_dir = corpus_dir or cfg.user_wd / "benchmark-corpora"
+    # cold numbers: no crop cache, no file index, whatever the recipe says
+    cfg["crop_cache_max_mb"] = 0
+    cfg["file_index"] = False
+    run_info = {
+        "run": get_time(),
+        "benchmark": "pipeline",
+        "software_version": cfg["software_version"],
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "image_size": list(cfg["original_image_size"]),
+    }
+
+    results = []
+    for n_images in sizes:
+        corpus = corpus_dir / f"n{n_images}-seed{seed}"
+        t0 = time.perf_counter()
+        make_corpus(corpus, n_images, cfg["original_image_size"], seed)
+        log.info(f"benchmark corpus n={n_images} ready in {time.perf_counter() - t0:.1f}s")
+        for backend in backends:
+            cfg["picture_backend"] = backend
+            result = {
+                **run_info,
+                "picture_backend": backend,
+                **bench_corpus(cfg, corpus, n_images),
+            }
+            log.info(f"benchmark n={n_images} {backend}: {result['stages']}")
+            with open(outpath, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+            results.append(result)
+    log.info(f"benchmark results appended to {outpath}")
+    return results
+
+
+def parse_importtime(stderr: str, top_n: int = 10) -> list[dict]:
+    """Slowest imports of the top two levels from `python -X importtime` output, cumulative time"""
+    imports = []
+    for line in stderr.splitlines():
+        fields = line[len("import time:") :].split("|")
+        if not line.startswith("import time:") or not fields[0].strip().isdigit():
+            continue
+        name = fields[2]
+        # nested imports are indented below their parent, keep two levels
+        if len(name) - len(name.lstrip()) > 3:
+            continue
+        imports.append({"module": name.strip(), "cumulative_s": int(fields[1]) / 1e6})
+    imports.sort(key=lambda x: x["cumulative_s"], reverse=True)
+    return imports[:top_n]
+
+
+def startup(repeats: int = 5) -> dict:
+    """
+    Times the GUI startup up to the window, importing main and loading the configuration,
+    in fresh interpreters. The first repeat is the coldest.
+
+    :param repeats: number of fresh interpreters, defaults to 5
+    :type repeats: int, optional
+    :return: wall time of each interpreter, median import and config times,
+        slowest top level imports and heavy modules imported
+    :rtype: dict
+    """
+    wall, runs, imports = [], [], []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        sp = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            encoding="utf-8",
+            check=True,
+        )
+        wall.append(round(time.perf_counter() - t0, 4))
+        line = [x for x in sp.stdout.splitlines() if x.startswith("STARTUP ")][-1]
+        runs.append(json.loads(line[len("STARTUP ") :]))
+        imports = imports or parse_importtime(sp.stderr)
+    return {
+        "wall_s": wall,
+        "import_s": round(statistics.median(x["import_s"] for x in runs), 4),
+        "config_s": round(statistics.median(x["config_s"] for x in runs), 4),
+        "heavy_modules": runs[-1]["heavy"],
+        "top_imports": imports,
+    }
+
+
+def run_startup(cfg: dict, outpath: Path = None, repeats: int = 5) -> dict:
+    """
+    Runs the startup benchmark and appends the result as a JSON line
+
+    :param outpath: results file, defaults to benchmarks.jsonl in `outf02`
+    :type outpath: pathlib.Path, optional
+    :return: result
+    :rtype: dict
+    """
+    outpath = outpath or cfg.user_folders["outf02"] / "benchmarks.jsonl"
+    result = {
+        "run": get_time(),
+        "benchmark": "startup",
+        "software_version": cfg["software_version"],
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        **startup(repeats),
+    }
+    cfg.log.info(
+        f"benchmark startup: import {result['import_s']}s, config {result['config_s']}s, "
+        f"heavy modules {result['heavy_modules']}"
+    )
+    with open(outpath, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    from cli import main
+
+    sys.exit(main(["bench", *sys.argv[1:]]))
@@ -0,0 +1,330 @@
+"""
+Headless command line entry point, for batch nodes without a display.
+
+    python -m tetk build <input_folder> --recipe config.yml --output deck.pptx --workers 8
+    python -m tetk batch jobs.yml --workers 4
+    python -m tetk bench --sizes 100 1000
+    python -m tetk bench --startup
+    python -m tetk bench --sizes 1000 --backends xml pptx
+    python -m tetk build <input_folder> --profile
+
+Tk and the GUI are never imported and the user configuration folder is not reset.
+"""
+import sys
+import logging
+import argparse
+from pathlib import Path
+
+import config
+from config import update_config_details
+from reader import FileManager
+from makeppt import PptManager
+from utils import PathFinder
+from fileindex import get_file_index
+from utils import _name_filter
+import perf
+from profiling import profile_run
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_ERRORS_LOGGED = 3
+
+LAYOUTS = ["run", "lot", "single"]
+
+
+class ErrorCounter(logging.Handler):
+    """Counts error records, images that fail are logged and skipped rather than raised"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="tetk", description="Test Engr Toolkit, headless deck generation"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build a deck from a folder of images")
+    build.add_argument("input", type=Path, help="input folder of images")
+    build.add_argument(
+        "-r",
+        "--recipe",
+        default="config.yml",
+        help="recipe .yml, a path or a name in the user configuration folder",
+    )
+    build.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="output .pptx, defaults to a timestamped deck in the output folder",
+    )
+    build.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="image preprocessing and scan workers, 0 uses all cores",
+    )
+    build.add_argument(
+        "-l",
+        "--layout",
+        choices=LAYOUTS,
+        default="run",
+        help="run: all images on one slide set, lot: a slide per lot, "
+        "single: single wafer comparison",
+    )
+    build.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile the build with cProfile and tracemalloc, reports go to the debug folder",
+    )
+
+    batch = subparsers.add_parser(
+        "batch", help="build many decks concurrently from a job list"
+    )
+    batch.add_argument("jobs", type=Path, help="job list .yml, see scheduler.load_jobs")
+    batch.add_argument(
+        "-w", "--workers", type=int, default=None, help="decks built at once"
+    )
+    batch.add_argument(
+        "--retries", type=int, default=None, help="retries of a failed deck"
+    )
+
+    bench = subparsers.add_parser(
+        "bench", help="time the pipeline on synthetic wafer map corpora"
+    )
+    bench.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=None,
+        help="numbers of images, defaults to 100 1000 10000 100000",
+    )
+    bench.add_argument(
+        "-r", "--recipe", default="config.yml", help="recipe .yml, as for build"
+    )
+    bench.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="results .jsonl, appended to, defaults to benchmarks.jsonl in the debug folder",
+    )
+    bench.add_argument(
+        "--corpus-dir",
+        type=Path,
+        default=None,
+        help="where the corpora are generated and reused",
+    )
+    bench.add_argument("--seed", type=int, default=0, help="seed of the corpora")
+    bench.add_argument(
+        "--backends",
+        nargs="+",
+        choices=["xml", "pptx"],
+        default=None,
+        help="picture backends to compare, defaults to the recipe's picture_backend",
+    )
+    bench.add_argument(
+        "--startup",
+        action="store_true",
+        help="time the GUI startup in fresh interpreters instead of the pipeline",
+    )
+    return parser
+
+
+def load_recipe(recipe: str) -> config.Config:
+    """
+    Configuration with `recipe` applied over the user configuration, without hard reset
+
+    :param recipe: path to a recipe .yml, or its name in the user configuration folder
+    :type recipe: str
+    :return: configuration
+    :rtype: config.Config
+    """
+    cfg = config.Config(hard_reset=False)
+    recipe_path = Path(recipe)
+    if not recipe_path.is_file():
+        recipe_path = cfg.user_config_folder / recipe
+    if not recipe_path.is_file():
+        raise FileNotFoundError(f"recipe not found; {recipe}")
+    cfg.apply_recipe(recipe_path)
+    cfg.log.info(f"recipe loaded. {recipe_path.name=}")
+    return update_config_details(cfg)
+
+
+def set_output(cfg: config.Config, output: Path) -> str:
+    """Points the output folder at the folder of `output`, returns the deck file name"""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    cfg.user_folders["outf01"] = output.parent.resolve()
+    return output.name
+
+
+def build(
+    cfg: config.Config,
+    input_folder: Path,
+    layout: str = "run",
+    outname: str = "",
+    include: str = None,
+):
+    """
+    Builds a deck the way the GUI Run buttons do
+
+    :param input_folder: folder of images
+    :type input_folder: pathlib.Path
+    :param layout: one of LAYOUTS, defaults to "run"
+    :type layout: str, optional
+    :param outname: file name of the deck in the output folder, defaults to a timestamped name
+    :type outname: str, optional
+    :param include: glob pattern on the file names, only matching images are used, defaults to None
+    :type include: str, optional
+    """
+    log = cfg.log
+    cfg.user_folders["inpf01"] = input_folder
+    ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+    if cfg["incremental_output"]:
+        ppt.open_incremental(outname or f"prod_{layout}.pptx")
+
+    if layout == "run":
+        fm = PathFinder(
+            cwd=input_folder,
+            scan_workers=cfg["scan_workers"],
+            index=get_file_index(cfg),
+        )
+        imgs = fm.get_image_files(".png")
+        if include:
+            keep = _name_filter((), include)
+            imgs = [x for x in imgs if keep(x.name)]
+        log.info(f"found {len(imgs)} images")
+        ppt.insert_images_wafersPerLot("images", imgs)
+    elif layout == "lot":
+        fmgr = FileManager(cfg, input_folder, fileext=include or "*.png")
+        data = fmgr.construct_lotPerPage()
+        ppt.prepare_lots(data)
+        for i, (name, imgpaths) in enumerate(data.items()):
+            log.info(f"lotRun{i:03d}: {name=}; {len(imgpaths)=}")
+            ppt.insert_images_wafersPerLot(name, imgpaths)
+    elif layout == "single":
+        fmgr = FileManager(cfg, input_folder, fileext=include or "*.png")
+        ppt.insert_images_singleWaferCompare(df=fmgr.construct_singleWafers())
+    else:
+        raise ValueError(f"unknown layout {layout}; {LAYOUTS}")
+    ppt.save_ppt(outname)
+
+
+def run_build(parser: argparse.ArgumentParser, args) -> int:
+    if not args.input.is_dir():
+        parser.error(f"input folder not found; {args.input}")
+    try:
+        cfg = load_recipe(args.recipe)
+    except Exception as e:
+        print(f"ERROR   : load recipe failed; {e}", file=sys.stderr)
+        return EXIT_USAGE
+    log = cfg.log
+
+    if args.workers is not None:
+        cfg["preprocess_workers"] = args.workers
+        cfg["scan_workers"] = args.workers or cfg["scan_workers"]
+    outname = ""
+    if args.output is not None:
+        outname = set_output(cfg, args.output)
+
+    if args.profile:
+        cfg["profile_mode"] = True
+
+    errors = ErrorCounter()
+    log.addHandler(errors)
+    perf.PERF.reset()
+    try:
+        with profile_run(cfg, f"build_{args.layout}"), perf.span("build"):
+            build(cfg, args.input.resolve(), layout=args.layout, outname=outname)
+    except Exception as e:
+        log.error(f"build failed; {e}")
+        return EXIT_FAILED
+    finally:
+        log.removeHandler(errors)
+    perf.write_report(cfg, f"build_{args.layout}")
+    if errors.count:
+        log.warning(f"deck built with {errors.count} errors logged")
+        return EXIT_ERRORS_LOGGED
+    return EXIT_OK
+
+
+def run_batch(parser: argparse.ArgumentParser, args) -> int:
+    # the scheduler imports this module for its workers
+    from scheduler import DeckScheduler, load_jobs
+
+    if not args.jobs.is_file():
+        parser.error(f"job list not found; {args.jobs}")
+    try:
+        jobs = load_jobs(args.jobs)
+        cfg = load_recipe("config.yml")
+    except Exception as e:
+        print(f"ERROR   : load jobs failed; {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.workers is not None:
+        cfg["job_workers"] = args.workers
+    if args.retries is not None:
+        cfg["job_retries"] = args.retries
+
+    results = DeckScheduler(cfg).run(jobs)
+    if any(x.status != "done" for x in results):
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def run_bench(parser: argparse.ArgumentParser, args) -> int:
+    import benchmark
+
+    if args.sizes is not None and min(args.sizes) < 1:
+        parser.error(f"sizes must be positive; {args.sizes}")
+    try:
+        cfg = load_recipe(args.recipe)
+    except Exception as e:
+        print(f"ERROR   : load recipe failed; {e}", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        if args.startup:
+            benchmark.run_startup(cfg, outpath=args.output)
+            return EXIT_OK
+        benchmark.run(
+            cfg,
+            sizes=args.sizes,
+            outpath=args.output,
+            corpus_dir=args.corpus_dir,
+            seed=args.seed,
+            backends=args.backends,
+        )
+    except Exception as e:
+        cfg.log.error(f"benchmark failed; {e}")
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def main(argv: list = None) -> int:
+    """
+    Runs the command line, returns the process exit code
+
+    :return: 0 ok, 1 build failed (any deck of a batch), 2 invalid arguments,
+        3 deck built but errors were logged
+    :rtype: int
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "batch":
+        return run_batch(parser, args)
+    if args.command == "bench":
+        return run_bench(parser, args)
+    return run_build(parser, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,10 @@ import subprocess
 import shutil
 import sys
 import re
+import functools
+
+import perf
+import profiling
 
 
 def get_latest_git_tag(repo_path: Path = None, err_code: str = "versionError") -> str:
@@ -24,6 +28,7 @@ def get_latest_git_tag(repo_path: Path = None, err_code: str = "versionError") -
     try:
         sp = subprocess.run(
             ["git", "describe", "--tag"],
+            cwd=repo_path,
             check=True,
             timeout=5,
             capture_output=True,
@@ -35,7 +40,8 @@ def get_latest_git_tag(repo_path: Path = None, err_code: str = "versionError") -
             results = err_code
 
     except Exception:
-        pass
+        # not a git checkout or no tag yet
+        results = err_code
 
     finally:
         return results
@@ -89,12 +95,26 @@ def chgdict_changekeyvalues(
 
 
 def classtimer(func):
+    """
+    Logs the elapsed time of a run method and returns its result.
+    The run is a root span of perf, its per-stage report is written in debug_mode.
+    In profile_mode the run is also profiled, see profiling.profile_run.
+    """
+
+    @functools.wraps(func)
     def wrapper(ref_self, *args, **kwargs):
         log = ref_self.log
-        # print(f"log={log}; *args={args}, **kwargs={kwargs}")
+        cfg = getattr(ref_self, "cfg", None)
+        if cfg is None and hasattr(ref_self, "root"):
+            cfg = ref_self.root.cfg
+        perf.PERF.reset()
         t0 = time.perf_counter()
-        func(ref_self, *args, **kwargs)
+        with profiling.profile_run(cfg, func.__name__), perf.span(func.__name__):
+            result = func(ref_self, *args, **kwargs)
         log.info(f"[{func.__name__}] elapsed_time = {(time.perf_counter()-t0):.4f}s")
+        if cfg is not None:
+            perf.write_report(cfg, func.__name__)
+        return result
 
     return wrapper
 
@@ -213,7 +233,47 @@ def writeTo_version_file(
         return False
 
 
+def refresh_version_file(
+    log: logging.Logger, parent_dir: Path, repo_path: Path, filename: str = "version.txt"
+) -> bool:
+    """
+    Rewrites the version file from `git describe` if it is missing or empty, or if HEAD,
+    the current branch or the tags changed since it was written,
+    otherwise startup costs a few stat calls
+
+    :param parent_dir: folder of the version file
+    :type parent_dir: pathlib.Path
+    :param repo_path: folder holding .git
+    :type repo_path: pathlib.Path
+    :return: True if the version file was rewritten
+    :rtype: bool
+    """
+    git_dir = repo_path / ".git"
+    sources = [git_dir / "HEAD", git_dir / "packed-refs", git_dir / "refs" / "tags"]
+    try:
+        head = sources[0].read_text().strip()
+        if head.startswith("ref: "):
+            sources.append(git_dir / head[5:])
+    except OSError:
+        pass
+    mtimes = [x.stat().st_mtime for x in sources if x.exists()]
+    version_file = parent_dir / filename
+    try:
+        # a checkout can leave an empty file newer than every git ref
+        current = version_file.read_text().strip()
+    except OSError:
+        current = ""
+    if current and (not mtimes or version_file.stat().st_mtime >= max(mtimes)):
+        return False
+    writeTo_version_file(
+        log, parent_dir, filename=filename, version=get_latest_git_tag(repo_path)
+    )
+    return True
+
+
+@functools.lru_cache(maxsize=8)
 def get_version(log: logging.Logger, version_file: Path):
+    # read once per process, the version file only changes before startup
     try:
         with open(version_file, "r") as fm:
             version = fm.readline()
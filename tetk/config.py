@@ -5,11 +5,55 @@ import yaml
 import shutil
 from pathlib import Path
 import commons
+import recipes
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from inspect import currentframe as cfr
 
 
+class LogListener(QueueListener):
+    """QueueListener that knows whether its thread runs in the current process"""
+
+    def start(self):
+        super().start()
+        self.pid = os.getpid()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self.pid == os.getpid()
+
+
+class AsyncLogHandler(QueueHandler):
+    """
+    Hands records to a LogListener thread which does the file and console I/O.
+    A full queue blocks the caller instead of losing records.
+    Without a running listener, i.e. after shutdown or in a forked worker process,
+    records are handled synchronously like a plain handler.
+
+    :param log_queue: queue shared with the listener, bounded
+    :type log_queue: queue.Queue
+    :param listener: listener draining `log_queue`
+    :type listener: LogListener
+    """
+
+    def __init__(self, log_queue: queue.Queue, listener: LogListener):
+        super().__init__(log_queue)
+        self.listener = listener
+
+    def enqueue(self, record):
+        self.queue.put(record)
+
+    def emit(self, record):
+        if self.listener.running:
+            super().emit(record)
+            return
+        for handler in self.listener.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
 class Config(dict):
     """
     Creates the configuration dict to allow user different configurations.
@@ -24,6 +68,10 @@ class Config(dict):
     :rtype: dict
     """
 
+    # attributes set on the instance end up in __dict__, the configuration itself;
+    # slots keep the loaded recipe and the compiled layout out of keys() and copy()
+    __slots__ = ("__dict__", "recipe", "_layout")
+
     def __init__(
         self,
         *,
@@ -46,18 +94,15 @@ class Config(dict):
         self.bundle_dir = self.wd / "bundles"
         self.bundle_config_file = self.bundle_dir / bundle_config_file
 
-        loaded_cfg = self.load_yaml(self.bundle_config_file)
-        self.update(loaded_cfg)
+        self.update(recipes.thaw(recipes.REGISTRY.get(self.bundle_config_file).values))
         self.setup_logger()
         log = self.log
 
         self.paths_init(hard_reset=hard_reset)
         log.info("default configuration initialised.")
 
-        self.user_config_file = self.user_config_folder / self.user_config_filename
         log.info(f"user input {config_filename=}")
-        user_cfg = self.load_yaml(self.user_config_file)
-        self.update(user_cfg, hard_reset=False)
+        self.apply_recipe(self.user_config_folder / self.user_config_filename)
         log.info(f"user configuration loaded. {self.user_config_file.name=}")
 
     def setup_logger(self, name="tetk", default_loglevel=logging.INFO):
@@ -94,8 +139,6 @@ class Config(dict):
             f_handler = RotatingFileHandler(
                 self.user_logfile, maxBytes=5_242_880, backupCount=10
             )
-            c_handler.setLevel(default_loglevel)
-            f_handler.setLevel(default_loglevel)
 
             # Create formatters and add it to handlers
             c_format = logging.Formatter("%(levelname)-8s: %(message)s")
@@ -105,9 +148,19 @@ class Config(dict):
             c_handler.setFormatter(c_format)
             f_handler.setFormatter(f_format)
 
+            # Console and file I/O run on a listener thread, logging calls only enqueue.
+            # The level is set on the queue handler, see FrameConsole.change_log_level
+            capacity = self["log_queue_size"] if "log_queue_size" in self else 10000
+            log_queue = queue.Queue(maxsize=capacity)
+            listener = LogListener(log_queue, c_handler, f_handler)
+            q_handler = AsyncLogHandler(log_queue, listener)
+            q_handler.setLevel(default_loglevel)
+            listener.start()
+            # stop() writes out the queued records before the program exits
+            atexit.register(listener.stop)
+
             # Add handlers to the logger
-            logger.addHandler(c_handler)
-            logger.addHandler(f_handler)
+            logger.addHandler(q_handler)
             logger.setLevel(default_loglevel)
 
         self.log = logger
@@ -237,22 +290,62 @@ class Config(dict):
         """loads the yaml files"""
         filepath = Path(filepath)
         assert filepath.is_file(), f"unable to load yaml, {filepath=}"
-        with open(filepath, "r") as stream:
+        try:
+            loaded_cfg = recipes.load_yaml(filepath)
+        except yaml.YAMLError as e:
             try:
-                loaded_cfg = yaml.safe_load(stream)
-            except yaml.YAMLError as e:
-                try:
-                    self.log.error(e)
-                except Exception:
-                    print(e)
+                self.log.error(e)
+            except Exception:
+                print(e)
         return loaded_cfg
 
+    def apply_recipe(self, filepath: Path) -> recipes.Recipe:
+        """
+        Applies a recipe over the factory defaults.
+        Keys of the previous recipe go back to their bundle default, keys the bundle does
+        not have are removed, settings made at runtime outside the recipes are kept.
+        The recipe is parsed and validated once, later switches reuse the parsed recipe
+        from the registry unless the file changed, paths are not initialised again.
+
+        :param filepath: recipe .yml
+        :type filepath: pathlib.Path
+        :raises ValueError: invalid recipe, the configuration is left unchanged
+        :return: recipe
+        :rtype: recipes.Recipe
+        """
+        recipe = recipes.REGISTRY.get(filepath)
+        defaults = recipes.REGISTRY.get(self.bundle_config_file)
+        previous = getattr(self, "recipe", None)
+        if previous is not None:
+            for key in previous.values:
+                if key not in defaults.values and key not in recipe.values:
+                    self.pop(key, None)
+        self.update(recipes.thaw(defaults.values))
+        self.update(recipes.thaw(recipe.values))
+        self.user_config_file = Path(filepath)
+        self.recipe = recipe
+        return recipe
+
+    @property
+    def layout(self) -> recipes.Layout:
+        """Layout constants in EMU, compiled again only when a layout key changed"""
+        key = tuple(
+            repr(self[x]) if x in self else None for x in recipes.LAYOUT_KEYS
+        )
+        cached = getattr(self, "_layout", None)
+        if cached is None or cached[0] != key:
+            cached = self._layout = (key, recipes.compile_layout(self))
+        return cached[1]
+
     def clear(self):
         return self.__dict__.clear()
 
     def copy(self):
         return self.__dict__.copy()
 
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
     def has_key(self, k):
         return k in self.__dict__
 
@@ -281,6 +374,16 @@ class Config(dict):
         return iter(self.__dict__)
 
 
+def update_config_details(cfg):
+    ## Added some descriptions
+    cfg["software_key"] = "tetk"
+    cfg["software_name"] = "Test Engr Toolkit"
+    cfg["software_version"] = commons.get_version(
+        cfg.log, cfg["user_config_folder"] / "version.txt"
+    )
+    return cfg
+
+
 def main():
     cfg = Config(config_filename="config.yml")
     log = cfg.log
@@ -0,0 +1,210 @@
+import os
+import time
+import sqlite3
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import perf
+from utils import FileTable, _name_filter, _scan_dir
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    folder TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime REAL,
+    PRIMARY KEY (folder, name)
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+"""
+
+# a directory modified this recently may still change within the same mtime tick
+MTIME_SETTLE_S = 2.0
+# wait for another writer of the same index, e.g. the GUI and a batch run
+BUSY_TIMEOUT_S = 30.0
+
+
+def _visit_dir(folder: str, known_mtime):
+    # stat only, the directory is listed again only if its mtime changed
+    try:
+        mtime = os.stat(folder).st_mtime
+    except FileNotFoundError:
+        return folder, None, None, None
+    if mtime == known_mtime:
+        return folder, mtime, None, None
+    files, subdirs = _scan_dir(folder)
+    return folder, mtime, files, subdirs
+
+
+class FileIndex:
+    """
+    Persistent index of input folders in a SQLite file.
+    A refresh only stats directories and lists again those whose mtime changed,
+    a warm refresh of an unchanged tree costs one stat per directory.
+    Files modified in place do not change their directory mtime,
+    such changes are caught by the content hashes of the crop cache and deck manifest.
+
+    :param db_path: SQLite file, created if missing
+    :type db_path: pathlib.Path
+    :param workers: number of threads visiting directories, defaults to 8
+    :type workers: int, optional
+    :param read_only: only read an index refreshed by another process, `scan` does not
+        refresh, e.g. in the batch workers, defaults to False
+    :type read_only: bool, optional
+    """
+
+    def __init__(self, log, db_path: Path, workers: int = 8, read_only: bool = False):
+        self.log = log
+        self.db_path = db_path
+        self.workers = workers
+        self.read_only = read_only
+        if not read_only:
+            with self._connect() as conn:
+                conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # short lived connections, the GUI calls this from different threads
+        if self.read_only:
+            conn = sqlite3.connect(f"{Path(self.db_path).as_uri()}?mode=ro", uri=True)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_S)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def refresh(self, root: Path) -> dict:
+        """
+        Brings the index of `root` up to date
+
+        :param root: folder to index
+        :type root: pathlib.Path
+        :return: number of directories visited, listed again and removed
+        :rtype: dict
+        """
+        t0 = time.perf_counter()
+        root = os.path.abspath(root)
+        stats = {"visited": 0, "rescanned": 0, "removed": 0}
+        with self._connect() as conn, ThreadPoolExecutor(self.workers) as pool:
+            known = dict(conn.execute("SELECT path, mtime FROM dirs"))
+            pending = [root]
+            while pending:
+                results = list(
+                    pool.map(lambda x: _visit_dir(x, known.get(x)), pending)
+                )
+                pending = []
+                for folder, mtime, files, subdirs in results:
+                    stats["visited"] += 1
+                    if mtime is None:
+                        stats["removed"] += self._remove_tree(conn, folder)
+                        continue
+                    if files is None:
+                        pending.extend(
+                            x
+                            for (x,) in conn.execute(
+                                "SELECT path FROM dirs WHERE parent = ?", (folder,)
+                            )
+                        )
+                        continue
+                    stats["rescanned"] += 1
+                    self._store_dir(conn, folder, mtime, files, subdirs)
+                    pending.extend(subdirs)
+        stats["elapsed_s"] = round(time.perf_counter() - t0, 4)
+        self.log.debug(f"file index refreshed; {stats}")
+        return stats
+
+    def _store_dir(self, conn, folder: str, mtime: float, files: list, subdirs: list):
+        if time.time() - mtime < MTIME_SETTLE_S:
+            # force a rescan next time, entries may still be added in this tick
+            mtime = -1
+        conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)",
+            (folder, os.path.dirname(folder), mtime),
+        )
+        conn.execute("DELETE FROM files WHERE folder = ?", (folder,))
+        conn.executemany(
+            "INSERT INTO files (folder, name, size, mtime) VALUES (?, ?, ?, ?)", files
+        )
+        old_subdirs = {
+            x for (x,) in conn.execute("SELECT path FROM dirs WHERE parent = ?", (folder,))
+        }
+        for subdir in old_subdirs - set(subdirs):
+            self._remove_tree(conn, subdir)
+
+    def _remove_tree(self, conn, folder: str) -> int:
+        folders = [(x,) for x in self._tree(conn, folder)]
+        conn.executemany("DELETE FROM dirs WHERE path = ?", folders)
+        conn.executemany("DELETE FROM files WHERE folder = ?", folders)
+        return len(folders)
+
+    def table(self, root: Path, exts=(".png",), include=None, exclude=None) -> FileTable:
+        """
+        Files of `root` from the index, call `refresh` first.
+        Same filters and result as utils.scan_files.
+
+        :return: parallel lists of folder, name, size, mtime
+        :rtype: FileTable
+        """
+        root = os.path.abspath(root)
+        keep = _name_filter(exts, include, exclude)
+
+        rows = []
+        with self._connect() as conn:
+            for tree_root in self._tree(conn, root):
+                rows.extend(
+                    row
+                    for row in conn.execute(
+                        "SELECT folder, name, size, mtime FROM files WHERE folder = ?",
+                        (tree_root,),
+                    )
+                    if keep(row[1])
+                )
+        rows.sort()
+        if not rows:
+            return FileTable([], [], [], [])
+        return FileTable(*(list(col) for col in zip(*rows)))
+
+    @staticmethod
+    def _tree(conn, root: str) -> list[str]:
+        folders, pending = [], [root]
+        while pending:
+            folder = pending.pop()
+            folders.append(folder)
+            pending.extend(
+                x for (x,) in conn.execute("SELECT path FROM dirs WHERE parent = ?", (folder,))
+            )
+        return folders
+
+    def scan(self, root: Path, **kwargs) -> FileTable:
+        """Refreshes the index of `root`, unless read only, and returns its files, see `table`"""
+        with perf.span("scan"):
+            if not self.read_only:
+                self.refresh(root)
+            table = self.table(root, **kwargs)
+        perf.count("files_scanned", len(table.name))
+        return table
+
+
+def get_file_index(cfg: dict):
+    """
+    FileIndex in the user working dir if `file_index` is enabled in the recipe,
+    read only if the runtime setting `file_index_read_only` is set
+
+    :return: file index, None if disabled
+    :rtype: FileIndex | None
+    """
+    if "file_index" not in cfg or not cfg["file_index"]:
+        return None
+    read_only = "file_index_read_only" in cfg and cfg["file_index_read_only"]
+    return FileIndex(
+        cfg.log, cfg.user_wd / "fileindex.sqlite", cfg["scan_workers"], read_only=read_only
+    )
@@ -0,0 +1,300 @@
+import io
+import os
+import math
+import time
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import PIL.Image
+
+import perf
+from imageprobe import probe_image
+
+
+# stored: the blob was written to the crop cache by this call
+PreparedImage = namedtuple(
+    "PreparedImage",
+    "filepath blob info cropped cache_hit source_size stored",
+    defaults=(False,),
+)
+
+EMU_PER_INCH = 914400
+# age after which a .tmp file in the crop cache is a leftover, not a write in progress
+TMP_MAX_AGE_S = 3600
+
+
+def target_width_px(width_emu: int, dpi: int):
+    """
+    Pixel width needed to fill a placed width at the given dpi
+
+    :param width_emu: placed width of the picture in EMU
+    :type width_emu: int
+    :param dpi: target resolution, 0 or None keeps full resolution
+    :type dpi: int
+    :return: width in pixels, None if no resampling is needed
+    :rtype: int | None
+    """
+    if not dpi or not width_emu:
+        return None
+    return max(1, math.ceil(width_emu / EMU_PER_INCH * dpi))
+
+
+def cache_key(source: bytes, *settings) -> str:
+    """
+    Content address of a prepared image, hash of the source bytes plus the
+    settings that change the output.
+
+    :param source: raw bytes of the source image
+    :type source: bytes
+    :return: hex digest used as the cache file name
+    :rtype: str
+    """
+    digest = hashlib.sha1(source)
+    digest.update("|".join(str(x) for x in settings).encode())
+    return digest.hexdigest()
+
+
+def prepare_image(
+    imgpath: Path,
+    original_size=None,
+    crop_coords=(0, 0, 0, 0),
+    width_px=None,
+    png_colors=0,
+    png_optimize=False,
+    cache_dir=None,
+) -> PreparedImage:
+    """
+    Crops, downsamples and re-encodes a single image into PNG bytes, ready for add_picture.
+    Images that do not match `original_size` are not cropped,
+    the size check only reads the image header from disk, before the file itself.
+    Images needing no change at all are passed through untouched and not cached.
+    The source file is never modified, results are kept in `cache_dir` instead.
+    Module level so that it can be pickled into the process pool.
+
+    :param imgpath: path to source image
+    :type imgpath: pathlib.Path
+    :param original_size: (width, height) of images that should be cropped, defaults to None
+    :type original_size: list, optional
+    :param crop_coords: left, upper, right, lower edges of the crop region
+    :type crop_coords: list, optional
+    :param width_px: downsample to this width if the image is wider, defaults to None
+    :type width_px: int, optional
+    :param png_colors: quantise to a palette of this many colours, defaults to 0 (off)
+    :type png_colors: int, optional
+    :param png_optimize: lossless PNG optimisation, slower to encode, defaults to False
+    :type png_optimize: bool, optional
+    :param cache_dir: crop cache folder, defaults to None (no caching)
+    :type cache_dir: pathlib.Path, optional
+    :return: prepared image bytes and its header info (width, height, dpi)
+    :rtype: PreparedImage
+    """
+    if not imgpath.is_file():
+        raise Exception(f"invalid image path: {imgpath}")
+    info = probe_image(imgpath)
+    crop = original_size is None or (info.width, info.height) == tuple(original_size)
+    width = crop_coords[2] - crop_coords[0] if crop else info.width
+    resize = width_px is not None and width > width_px
+    source = imgpath.read_bytes()
+    if not (crop or resize or png_colors or png_optimize):
+        return PreparedImage(imgpath, source, info, False, False, len(source))
+
+    cache_file = None
+    if cache_dir is not None:
+        key = cache_key(
+            source, original_size, list(crop_coords), width_px, png_colors, png_optimize
+        )
+        cache_file = cache_dir / f"{key}.img"
+        try:
+            blob = cache_file.read_bytes()
+            # touch, the mtime is the LRU clock of the cache
+            os.utime(cache_file)
+            return PreparedImage(
+                imgpath, blob, probe_image(blob), None, True, len(source)
+            )
+        except FileNotFoundError:
+            pass
+
+    with PIL.Image.open(io.BytesIO(source)) as img:
+        if crop:
+            img = img.crop(tuple(crop_coords))
+        if resize:
+            height = max(1, round(img.height * width_px / img.width))
+            img = img.resize((width_px, height), PIL.Image.Resampling.LANCZOS)
+        if png_colors and img.mode != "P":
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            img = img.quantize(colors=png_colors, method=PIL.Image.Quantize.FASTOCTREE)
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG", optimize=png_optimize)
+    blob = buffer.getvalue()
+    prepared = PreparedImage(imgpath, blob, probe_image(blob), crop, False, len(source))
+
+    if cache_file is not None:
+        # write then rename, other workers may be reading the same key
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_bytes(prepared.blob)
+        os.replace(tmp_file, cache_file)
+        prepared = prepared._replace(stored=True)
+    return prepared
+
+
+def _prepare_image_or_error(imgpath: Path, **kwargs):
+    # a bad image must not abort the whole pool.map, hand the error back instead
+    try:
+        return prepare_image(imgpath, **kwargs)
+    except Exception as e:
+        return Exception(f"{imgpath.name}; {e}")
+
+
+class CropCache:
+    """
+    Content-addressed store of prepared images on disk, with LRU eviction.
+    Entries are named by `cache_key`, file mtime is used as the last access time.
+
+    :param cache_dir: folder holding the cache entries
+    :type cache_dir: pathlib.Path
+    :param max_mb: size cap of the cache in MB
+    :type max_mb: float
+    """
+
+    def __init__(self, log, cache_dir: Path, max_mb: float):
+        self.log = log
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.total_bytes = sum(
+            entry.stat().st_size
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".img")
+        )
+
+    def add(self, nbytes: int):
+        self.total_bytes += nbytes
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # several processes may share the cache, entries can vanish while listing
+        entries = []
+        stale = time.time() - TMP_MAX_AGE_S
+        for entry in os.scandir(self.cache_dir):
+            is_tmp = entry.name.endswith(".tmp")
+            if not (is_tmp or entry.name.endswith(".img")):
+                continue
+            try:
+                stat = entry.stat()
+                if is_tmp:
+                    # left over by a worker that died between write and rename,
+                    # recent ones may still be renamed
+                    if stat.st_mtime < stale:
+                        os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            removed += 1
+        self.log.debug(f"crop cache evicted {removed} entries")
+
+
+class ImagePreprocessor:
+    """
+    Prepares images on a process pool before slide assembly.
+    Results are always returned in input order, so the output deck is the same
+    whatever the number of workers.
+
+    :param cfg: configuration, uses `preprocess_workers`, `original_image_size`,
+        `crop_coords`, `crop_cache_max_mb`, `embed_dpi`, `embed_png_colors`,
+        `embed_png_optimize`
+    :type cfg: config.Config
+    """
+
+    def __init__(self, cfg: dict):
+        self.cfg = cfg
+        self.log = cfg.log
+        workers = int(self._setting("preprocess_workers", 0))
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self._pool = None
+
+        self.cache = None
+        cache_mb = self._setting("crop_cache_max_mb", 0)
+        cache_dir = getattr(cfg, "user_folders", {}).get("cache01")
+        if cache_mb and cache_dir is not None:
+            self.cache = CropCache(self.log, cache_dir, cache_mb)
+        else:
+            self.log.debug("crop cache disabled")
+
+    def _setting(self, key, default):
+        return self.cfg[key] if key in self.cfg else default
+
+    def width_px(self, width_emu: int):
+        """Pixel width to downsample to for a placed width, None when `embed_dpi` is off"""
+        return target_width_px(width_emu, self._setting("embed_dpi", 0))
+
+    def run(self, imgpaths: list[Path], width_px: int = None) -> list[PreparedImage]:
+        """
+        Prepares all images, bad images are logged and left out of the results
+
+        :param imgpaths: list of image paths
+        :type imgpaths: list[pathlib.Path]
+        :param width_px: downsample wider images to this width, see `width_px()`
+        :type width_px: int, optional
+        :return: prepared images, in the same order as `imgpaths`
+        :rtype: list[PreparedImage]
+        """
+        task = partial(
+            _prepare_image_or_error,
+            original_size=self.cfg["original_image_size"],
+            crop_coords=self.cfg["crop_coords"],
+            width_px=width_px,
+            png_colors=self._setting("embed_png_colors", 0),
+            png_optimize=self._setting("embed_png_optimize", False),
+            cache_dir=None if self.cache is None else self.cache.cache_dir,
+        )
+        if not imgpaths:
+            return []
+        with perf.span("crop"):
+            if self.workers == 1 or len(imgpaths) == 1:
+                results = [task(imgpath) for imgpath in imgpaths]
+            else:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                    self.log.debug(f"image preprocessing pool started, {self.workers=}")
+                chunksize = max(1, len(imgpaths) // (self.workers * 4))
+                results = list(self._pool.map(task, imgpaths, chunksize=chunksize))
+
+        prepared, new_bytes = [], 0
+        for result in results:
+            if isinstance(result, Exception):
+                self.log.error(f"prepare image failed; {result}")
+                continue
+            prepared.append(result)
+            if result.stored:
+                new_bytes += len(result.blob)
+
+        perf.count("images_prepared", len(prepared))
+        perf.count("bytes_read", sum(x.source_size for x in prepared))
+        if self.cache is not None:
+            hits = sum(x.cache_hit for x in prepared)
+            perf.count("crop_cache_hits", hits)
+            self.log.info(f"crop cache: {hits}/{len(prepared)} images reused")
+            self.cache.add(new_bytes)
+        return prepared
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
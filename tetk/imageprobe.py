@@ -0,0 +1,130 @@
+import io
+import struct
+from collections import namedtuple
+from pathlib import Path
+
+import PIL.Image
+
+
+# ext is the canonical extension python-pptx names the image part with, None if unsupported
+ImageInfo = namedtuple("ImageInfo", "width height dpi ext")
+
+DEFAULT_DPI = (72, 72)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# SOF markers carrying the frame size, DHT (C4), JPG (C8) and DAC (CC) excluded
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7}
+JPEG_SOF_MARKERS |= {0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# same mapping as pptx.parts.image.Image.ext
+EXT_BY_FORMAT = {
+    "BMP": "bmp",
+    "GIF": "gif",
+    "JPEG": "jpg",
+    "PNG": "png",
+    "TIFF": "tiff",
+    "WMF": "wmf",
+}
+
+
+def _probe_png(stream) -> ImageInfo:
+    width = height = None
+    dpi = DEFAULT_DPI
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"IHDR":
+            width, height = struct.unpack(">II", stream.read(8))
+            stream.seek(length - 8 + 4, io.SEEK_CUR)
+        elif chunk_type == b"pHYs":
+            ppu_x, ppu_y, unit = struct.unpack(">IIB", stream.read(9))
+            if unit == 1:
+                # pixels per metre
+                dpi = (round(ppu_x * 0.0254), round(ppu_y * 0.0254))
+            stream.seek(4, io.SEEK_CUR)
+        elif chunk_type in (b"IDAT", b"IEND"):
+            # pHYs must come before the image data, nothing left to read
+            break
+        else:
+            stream.seek(length + 4, io.SEEK_CUR)
+    if width is None:
+        raise ValueError("PNG without IHDR")
+    return ImageInfo(width, height, dpi, "png")
+
+
+def _probe_jpeg(stream) -> ImageInfo:
+    dpi = DEFAULT_DPI
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            break
+        if byte != b"\xff":
+            continue
+        marker = stream.read(1)
+        while marker == b"\xff":
+            marker = stream.read(1)
+        if not marker:
+            break
+        marker = marker[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            # standalone markers without a length field
+            continue
+        (length,) = struct.unpack(">H", stream.read(2))
+        if marker == 0xE0:
+            segment = stream.read(length - 2)
+            if segment[:5] == b"JFIF\x00" and len(segment) >= 12:
+                unit, x_density, y_density = struct.unpack(">BHH", segment[7:12])
+                if unit == 1:
+                    dpi = (x_density, y_density)
+                elif unit == 2:
+                    dpi = (round(x_density * 2.54), round(y_density * 2.54))
+        elif marker in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack(">BHH", stream.read(5))
+            return ImageInfo(width, height, dpi, "jpg")
+        else:
+            stream.seek(length - 2, io.SEEK_CUR)
+    raise ValueError("JPEG without SOF marker")
+
+
+def _probe_pil(stream) -> ImageInfo:
+    # lazy open, PIL only parses the header here
+    with PIL.Image.open(stream) as img:
+        dpi = img.info.get("dpi", DEFAULT_DPI)
+        return ImageInfo(
+            img.size[0],
+            img.size[1],
+            tuple(round(x) for x in dpi),
+            EXT_BY_FORMAT.get(img.format),
+        )
+
+
+def _probe_stream(stream) -> ImageInfo:
+    signature = stream.read(8)
+    try:
+        if signature == PNG_SIGNATURE:
+            return _probe_png(stream)
+        if signature[:2] == b"\xff\xd8":
+            stream.seek(2)
+            return _probe_jpeg(stream)
+    except (struct.error, ValueError):
+        pass
+    stream.seek(0)
+    return _probe_pil(stream)
+
+
+def probe_image(source: Path | bytes) -> ImageInfo:
+    """
+    Reads width, height and DPI from the image header without decoding pixels.
+    PNG (IHDR, pHYs) and JPEG (JFIF, SOF) are parsed directly,
+    only the few hundred header bytes are read from disk.
+    Other formats fall back to a lazy PIL open.
+
+    :param source: path to image, or the image bytes
+    :type source: pathlib.Path | bytes
+    :return: width and height in pixels, (x, y) dpi, file extension
+    :rtype: ImageInfo
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return _probe_stream(io.BytesIO(source))
+    with open(source, "rb") as stream:
+        return _probe_stream(stream)
@@ -0,0 +1,166 @@
+import time
+import queue
+import itertools
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+ProgressEvent = namedtuple("ProgressEvent", "job_id name state done total eta_s message")
+
+
+class JobCancelled(BaseException):
+    """
+    Raised at the next checkpoint of a cancelled job.
+    A BaseException like KeyboardInterrupt, so that the `except Exception` handlers
+    around single images and in the run functions do not swallow it.
+    """
+
+
+class CancelToken:
+    """Cooperative cancellation flag, checked by the job at its checkpoints"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+
+class Job:
+    """
+    Handle given to a running job function, to report progress and check for cancellation
+
+    :param job_id: id given by the runner
+    :type job_id: int
+    :param name: display name
+    :type name: str
+    :param events: queue receiving the ProgressEvents
+    :type events: queue.Queue
+    """
+
+    def __init__(self, job_id: int, name: str, events: queue.Queue):
+        self.id = job_id
+        self.name = name
+        self.token = CancelToken()
+        self.events = events
+        self.state = "queued"
+        self.done = 0
+        self.total = 0
+        self.t0 = None
+
+    def emit(self, state: str = None, message: str = ""):
+        if state is not None:
+            self.state = state
+        eta_s = None
+        if self.t0 is not None and self.done and self.total > self.done:
+            elapsed = time.perf_counter() - self.t0
+            eta_s = elapsed / self.done * (self.total - self.done)
+        self.events.put(
+            ProgressEvent(
+                self.id, self.name, self.state, self.done, self.total, eta_s, message
+            )
+        )
+
+    def set_total(self, total: int):
+        """Number of images the job will process, for the progress bar and ETA"""
+        self.total = total
+        self.emit()
+
+    def advance(self, n: int = 1):
+        """Checkpoint after `n` images, raises JobCancelled if the job was cancelled"""
+        self.token.check()
+        self.done += n
+        self.emit()
+
+    def check(self):
+        self.token.check()
+
+
+class JobRunner:
+    """
+    Runs the GUI jobs on one bounded thread pool, in submission order.
+    Jobs wait in the queue while the workers are busy, so two heavy runs never overlap
+    with the default single worker. The Tk main loop polls `events` without blocking.
+
+    :param max_workers: number of jobs running at once, defaults to 1
+    :type max_workers: int, optional
+    """
+
+    def __init__(self, log, max_workers: int = 1):
+        self.log = log
+        self.events = queue.Queue()
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, name: str, func, *args) -> Job:
+        """
+        Queues `func(*args, job=job)`
+
+        :param name: display name of the job
+        :type name: str
+        :param func: job function, takes a keyword argument `job`
+        :type func: callable
+        :return: job handle
+        :rtype: Job
+        """
+        job = Job(next(self._ids), name, self.events)
+        self.jobs[job.id] = job
+        job.emit("queued")
+        self._pool.submit(self._run, job, func, *args)
+        return job
+
+    def _run(self, job: Job, func, *args):
+        if job.token.cancelled:
+            job.emit("cancelled")
+            return
+        job.t0 = time.perf_counter()
+        job.emit("running")
+        try:
+            func(*args, job=job)
+        except JobCancelled:
+            self.log.warning(f"{job.name} cancelled after {job.done} images")
+            job.emit("cancelled")
+        except Exception as e:
+            self.log.error(f"{job.name} failed; {e}")
+            job.emit("failed", str(e))
+        else:
+            job.emit("done")
+        finally:
+            self.jobs.pop(job.id, None)
+
+    def cancel(self, job_id: int):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.token.cancel()
+
+    def cancel_all(self):
+        """Cancels the running job and every queued job"""
+        for job in list(self.jobs.values()):
+            job.token.cancel()
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.jobs)
+
+    def drain_events(self) -> list[ProgressEvent]:
+        """Events reported since the last call, never blocks"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get(block=False))
+            except queue.Empty:
+                return events
+
+    def shutdown(self):
+        self.cancel_all()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -7,52 +7,48 @@ from tkinter.scrolledtext import ScrolledText
 import queue
 import threading
 import logging
+import multiprocessing
 from inspect import currentframe as cfr
 import platform
 
 import commons
-from commons import open_folder, get_latest_git_tag, classtimer
+from commons import open_folder, classtimer
 from commons import InvalidPathError
 import config
-from reader import FileManager
-from makeppt import PptManager
-from utils import PathFinder
-
-
-def update_config_details(cfg):
-    ## Added some descriptions
-    cfg["software_key"] = "tetk"
-    cfg["software_name"] = "Test Engr Toolkit"
-    cfg["software_version"] = commons.get_version(
-        cfg.log, cfg["user_config_folder"] / "version.txt"
-    )
-    return cfg
+from config import update_config_details
+from jobrunner import JobRunner
+
+# pandas, python-pptx and PIL are imported on first use by the run functions,
+# the window shows without them. Importing this module has no side effects,
+# the configuration is loaded by load_config()
+cfg = None
+log = logging.getLogger("tetk")
 
 
-if getattr(sys, "frozen", False):
-    # Program is a frozen exe
-    # Initiates the config dictionary by loading from User's Config Folder
-    # (Located in ~/Documents/~)
-    cfg = config.Config(config_filename="config.yml", hard_reset=False)
-    cfg.log.info("THIS PROGRAM IS FROZEN!!")
-else:
-    # Initiates the config dictionary (global var), with hard reset
-    # User configuration folder will be erased (from ~/Documents/)
-    cfg = config.Config(config_filename="config.yml", hard_reset=True)
-    # writes a version info file based on git tags
-    commons.writeTo_version_file(
-        cfg.log,
-        cfg.bundle_dir,
-        filename="version.txt",
-        version=get_latest_git_tag(repo_path=Path(__file__).parent.parent),
-    )
-    commons.copy_version_to_userConfigFolder(
-        srcDir=cfg.bundle_dir, dstDir=cfg.user_config_folder
-    )
-    cfg.log.info("hard reset triggered")
-
-cfg = update_config_details(cfg)
-log = cfg.log
+def load_config(hard_reset: bool = False) -> config.Config:
+    """
+    Loads the user configuration into the module globals `cfg` and `log`.
+    Unfrozen, the version file is refreshed from the git tags when they changed.
+
+    :param hard_reset: reinitialise the user configuration folder from the bundle, defaults to False
+    :type hard_reset: bool, optional
+    :return: configuration
+    :rtype: config.Config
+    """
+    global cfg, log
+    if not getattr(sys, "frozen", False):
+        # before Config, which copies the version file to the user configuration folder
+        commons.refresh_version_file(
+            log, commons.get_path_bundles(), repo_path=Path(__file__).parent.parent
+        )
+    cfg = config.Config(config_filename="config.yml", hard_reset=hard_reset)
+    if getattr(sys, "frozen", False):
+        cfg.log.info("THIS PROGRAM IS FROZEN!!")
+    if hard_reset:
+        cfg.log.info("hard reset triggered")
+    cfg = update_config_details(cfg)
+    log = cfg.log
+    return cfg
 
 
 class Task(threading.Thread):
@@ -80,9 +76,48 @@ class QueueHandler(logging.Handler):
     def __init__(self, log_queue):
         super().__init__()
         self.log_queue = log_queue
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
 
     def emit(self, record):
-        self.log_queue.put(record)
+        # never block the logging thread on a full queue, the console reports the drops
+        try:
+            self.log_queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def take_dropped(self) -> int:
+        """Number of records dropped since the last call, read and reset together"""
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+def coalesce_log_records(records: list, max_batch: int):
+    """
+    Records to display in one console refresh.
+    Warnings and errors are always kept, lower levels beyond `max_batch` are suppressed,
+    the most recent ones are kept.
+
+    :param records: records drained from the queue, oldest first
+    :type records: list[logging.LogRecord]
+    :param max_batch: number of records to display
+    :type max_batch: int
+    :return: records to display, number suppressed
+    :rtype: tuple[list, int]
+    """
+    if len(records) <= max_batch:
+        return records, 0
+    n_important = sum(x.levelno >= logging.WARNING for x in records)
+    n_other = max(0, max_batch - n_important)
+    kept, skip = [], len(records) - n_important - n_other
+    for record in records:
+        if record.levelno < logging.WARNING and skip > 0:
+            skip -= 1
+            continue
+        kept.append(record)
+    return kept, len(records) - len(kept)
 
 
 class DefineTkStyle(ttk.Style):
@@ -174,7 +209,11 @@ class FrameConsole(ttk.Frame):
             self.scrolled_text.tag_config("CRITICAL", foreground="red", underline=1)
 
             # Create a logging handler using a queue
-            self.log_queue = queue.Queue()
+            cfg = root.cfg
+            self.max_lines = cfg["console_max_lines"] if "console_max_lines" in cfg else 2000
+            self.max_batch = cfg["console_max_batch"] if "console_max_batch" in cfg else 200
+            queue_size = cfg["console_queue_size"] if "console_queue_size" in cfg else 10000
+            self.log_queue = queue.Queue(maxsize=queue_size)
             self.queue_handler = QueueHandler(self.log_queue)
             formatter = logging.Formatter("%(asctime)s: %(message)s", "%H:%M")
             self.queue_handler.setFormatter(formatter)
@@ -206,22 +245,34 @@ class FrameConsole(ttk.Frame):
         except Exception as e:
             raise Exception(f"{self.__class__.__name__};{e}")
 
-    def display(self, record):
-        msg = self.queue_handler.format(record)
+    def display(self, records: list, suppressed: int = 0):
+        # one insert of all (text, tag) pairs, one scroll, one trim per refresh
+        chunks = []
+        if suppressed:
+            chunks += [f"... {suppressed} messages suppressed, see log file\n", "WARNING"]
+        for record in records:
+            chunks += [self.queue_handler.format(record) + "\n", record.levelname]
+        if not chunks:
+            return
         self.scrolled_text.configure(state="normal", wrap="none")
-        self.scrolled_text.insert(tk.END, msg + "\n", record.levelname)
+        self.scrolled_text.insert(tk.END, *chunks)
+        n_lines = int(self.scrolled_text.index("end-1c").split(".")[0])
+        if n_lines > self.max_lines:
+            self.scrolled_text.delete("1.0", f"{n_lines - self.max_lines + 1}.0")
         self.scrolled_text.yview(tk.END)
         self.scrolled_text.config(state="disabled")
 
     def poll_log_queue(self):
+        # Check every 100ms for new messages, everything queued is drained at once
+        records = []
         while True:
-            # Check every 100ms if there is a new message in the queue to display
             try:
-                record = self.log_queue.get(block=False)
+                records.append(self.log_queue.get(block=False))
             except queue.Empty:
                 break
-            else:
-                self.display(record)
+        records, suppressed = coalesce_log_records(records, self.max_batch)
+        suppressed += self.queue_handler.take_dropped()
+        self.display(records, suppressed)
         self.after(100, self.poll_log_queue)
 
     def change_log_level(self, log):
@@ -411,7 +462,7 @@ class MainFrameAA(ttk.Frame):
                 self,
                 text="Run",
                 style="BigButton.TButton",
-                command=lambda: Task(self, self.prod_run, "prod_run"),
+                command=lambda: root.jobs.submit("prod_run", self.prod_run),
             ).grid(row=41, column=0, columnspan=4, sticky="nsew")
 
             ttk.Label(self).grid(row=50, column=1, columnspan=4, sticky="nsew", padx=1)
@@ -419,20 +470,43 @@ class MainFrameAA(ttk.Frame):
                 self,
                 text="Run - Only lot_id plots",
                 style="TButton",
-                command=lambda: Task(self, self.prod_lot_id_plots, "prod_lot_id_plots"),
+                command=lambda: root.jobs.submit(
+                    "prod_lot_id_plots", self.prod_lot_id_plots
+                ),
             ).grid(row=51, column=0, columnspan=2, sticky="nsew")
             ttk.Button(
                 self,
                 text="Run - Only comparison single plots",
                 style="TButton",
-                command=lambda: Task(self, self.prod_single_plots, "prod_single_plots"),
+                command=lambda: root.jobs.submit(
+                    "prod_single_plots", self.prod_single_plots
+                ),
             ).grid(row=51, column=2, columnspan=2, sticky="nsew")
 
+            ttk.Label(self).grid(row=60, column=1, columnspan=4, sticky="nsew", padx=1)
+            self.progressbar = ttk.Progressbar(
+                self, variable=root.var_progress, maximum=100, mode="determinate"
+            )
+            self.progressbar.grid(row=61, column=0, columnspan=3, sticky="nsew", pady=3)
+            ttk.Button(
+                self,
+                text="Cancel",
+                style="SmallButton.TButton",
+                command=lambda: root.jobs.cancel_all(),
+            ).grid(row=61, column=3, columnspan=1, sticky="nsew")
+            ttk.Label(self, textvariable=root.var_progress_text, anchor=tk.W).grid(
+                row=62, column=0, columnspan=4, sticky="nsew"
+            )
+
         except Exception as e:
             raise Exception(f"{self.__class__.__name__};{e}")
 
     @classtimer
-    def prod_run(self):
+    def prod_run(self, job=None):
+        from makeppt import PptManager
+        from utils import PathFinder
+        from fileindex import get_file_index
+
         try:
             log = self.root.log
             cfg = self.root.cfg
@@ -449,8 +523,17 @@ class MainFrameAA(ttk.Frame):
             # fmgr = FileManager(cfg, cfg.user_folders["inpf01"])
             # data = fmgr.construct_lotPerPage()
             ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
-            fm = PathFinder(cwd=cfg.user_folders["inpf01"])
+            if cfg["incremental_output"]:
+                ppt.open_incremental("prod_run.pptx")
+            fm = PathFinder(
+                cwd=cfg.user_folders["inpf01"],
+                scan_workers=cfg["scan_workers"],
+                index=get_file_index(cfg),
+            )
             imgs = fm.get_image_files(".png")
+            ppt.job = job
+            if job is not None:
+                job.set_total(len(imgs))
             ppt.insert_images_wafersPerLot("images", imgs)
 
             # for i, (wafer_id, wafer_imgpaths) in enumerate(data.items()):
@@ -468,9 +551,14 @@ class MainFrameAA(ttk.Frame):
 
         except Exception as e:
             log.error(f"{cfr().f_code.co_name}();{e}")
+            # the job runner reports the job failed, JobCancelled is not caught here
+            raise
 
     @classtimer
-    def prod_single_plots(self):
+    def prod_single_plots(self, job=None):
+        from reader import FileManager
+        from makeppt import PptManager
+
         try:
             log = self.root.log
             cfg = self.root.cfg
@@ -478,20 +566,25 @@ class MainFrameAA(ttk.Frame):
             self.root.functional_buttons["detect_images"].invoke()
             fmgr = FileManager(cfg, cfg.user_folders["inpf01"])
             ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+            if cfg["incremental_output"]:
+                ppt.open_incremental("prod_single_plots.pptx")
             data = fmgr.construct_singleWafers()
-            ppt.insert_images_singleWaferCompare(
-                df=data,
-                stepsize_x=cfg["wafer_id_single_size_width_cm"],
-                stepsize_y=cfg["wafer_id_single_size_width_cm"],
-                fixed_width=cfg["wafer_id_single_size_width_cm"],
-            )
+            ppt.job = job
+            if job is not None:
+                job.set_total(data.size)
+            ppt.insert_images_singleWaferCompare(df=data)
             ppt.save_ppt()
 
         except Exception as e:
             log.error(f"{cfr().f_code.co_name}();{e}")
+            # the job runner reports the job failed, JobCancelled is not caught here
+            raise
 
     @classtimer
-    def prod_lot_id_plots(self):
+    def prod_lot_id_plots(self, job=None):
+        from reader import FileManager
+        from makeppt import PptManager
+
         try:
             log = self.root.log
             cfg = self.root.cfg
@@ -500,6 +593,12 @@ class MainFrameAA(ttk.Frame):
             fmgr = FileManager(cfg, cfg.user_folders["inpf01"])
             data = fmgr.construct_lotPerPage()
             ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+            if cfg["incremental_output"]:
+                ppt.open_incremental("prod_lot_id_plots.pptx")
+            ppt.job = job
+            if job is not None:
+                job.set_total(sum(len(fps) for fps in data.values()))
+            ppt.prepare_lots(data)
             for i, (wafer_id, wafer_imgpaths) in enumerate(data.items()):
                 cfg.log.info(f"lotRun{i:03d}: {wafer_id=}; {len(wafer_imgpaths)=}")
                 ppt.insert_images_wafersPerLot(wafer_id, wafer_imgpaths)
@@ -507,6 +606,8 @@ class MainFrameAA(ttk.Frame):
 
         except Exception as e:
             log.error(f"{cfr().f_code.co_name}();{e}")
+            # the job runner reports the job failed, JobCancelled is not caught here
+            raise
 
 
 class MainFrameAB(ttk.Frame):
@@ -564,12 +665,19 @@ class MainFrameAB(ttk.Frame):
             self.root.log.error(f"{cfr().f_code.co_name}();{e}")
 
     def detect_input_images(self):
+        from utils import PathFinder
+        from fileindex import get_file_index
+
         log = self.root.log
         try:
             self.scrolled_text.delete("1.0", tk.END)
             # fmgr = FileManager(self.root.cfg, self.root.cfg.user_folders["inpf01"])
             # print(f"{self.root.cfg.user_folders['inpf01']=}")
-            fmgr = PathFinder(cwd=self.root.cfg.user_folders["inpf01"])
+            fmgr = PathFinder(
+                cwd=self.root.cfg.user_folders["inpf01"],
+                scan_workers=self.root.cfg["scan_workers"],
+                index=get_file_index(self.root.cfg),
+            )
             try:
                 imgs = fmgr.get_image_files()
             except Exception:
@@ -658,6 +766,15 @@ class AppMenuBar(tk.Menu):
             self.root.var_recipe_loaded = tk.StringVar(value="error.yml")
             self.get_recipes()
 
+            self.file.add_separator()
+            self.root.var_profile_mode = tk.BooleanVar(
+                value=bool(self.root.cfg["profile_mode"])
+            )
+            self.file.add_checkbutton(
+                label="Profile runs",
+                variable=self.root.var_profile_mode,
+                command=self.toggle_profile_mode,
+            )
             self.file.add_separator()
             self.var_userFiles = []
             self.file.add_command(label="Factory reset", command=self.factory_reset)
@@ -707,26 +824,30 @@ class AppMenuBar(tk.Menu):
             log = self.root.log
 
             if recipe_f is None:
-                new_cfg = config.Config(hard_reset=False)
-
+                recipe_path = cfg.user_config_folder / "config.yml"
             else:
                 recipe_path = cfg.user_config_folder / recipe_f
-                if recipe_path.is_file():
-                    new_cfg = config.Config(hard_reset=False, config_filename=recipe_f)
-                else:
-                    raise InvalidPathError(f"{recipe_path = }")
+            if not recipe_path.is_file():
+                raise InvalidPathError(f"{recipe_path = }")
 
-            cfg.update(new_cfg)
+            # parsed once per recipe file, switching back and forth only stats the file
+            cfg.apply_recipe(recipe_path)
             cfg = update_config_details(cfg)
             self.root.var_recipe_loaded_description.set(
                 f"{cfg['project_name']}_v{cfg['recipe_version']}"
             )
             cfgfile = str(cfg.user_config_file.resolve())
             log.info(f"recipe loaded. {cfgfile = }")
+            self.root.var_profile_mode.set(bool(cfg["profile_mode"]))
 
         except Exception as e:
             log.error(f"{cfr().f_code.co_name}(); {e}")
 
+    def toggle_profile_mode(self):
+        cfg = self.root.cfg
+        cfg["profile_mode"] = self.root.var_profile_mode.get()
+        self.root.log.info(f"updated to {cfg['profile_mode']=}")
+
     def factory_reset(self):
         try:
             self.root.cfg.factory_reset()
@@ -765,6 +886,9 @@ class App(tk.Tk):
             self.pptmanager = None
             self.data = {}
             self.var_recipe_loaded_description = tk.StringVar()
+            self.var_progress = tk.DoubleVar(value=0)
+            self.var_progress_text = tk.StringVar(value="idle")
+            self.jobs = JobRunner(cfg.log)
 
             self.resizable(width=False, height=False)
             self.configure(background="#ebebeb")
@@ -794,6 +918,7 @@ class App(tk.Tk):
             self.update_idletasks()
             self.deiconify()
             self.menubar.load_recipe()
+            self.after(100, self.poll_job_events)
 
         except Exception as e:
             raise Exception(f"{self.__class__.__name__};{e}")
@@ -803,16 +928,41 @@ class App(tk.Tk):
         self.cfg[cfgkey] = value
         self.log.info(f"cfg({cfgkey}) updated to {value} ")
 
+    def poll_job_events(self):
+        # progress events are queued by the job thread, Tk is only touched here
+        for event in self.jobs.drain_events():
+            self.show_progress(event)
+        self.after(100, self.poll_job_events)
+
+    def show_progress(self, event):
+        if event.state == "running" and not event.done:
+            self.var_progress.set(0)
+        elif event.total:
+            self.var_progress.set(100 * event.done / event.total)
+        text = f"{event.name}: {event.state}"
+        if event.total:
+            text += f", {event.done}/{event.total} images"
+        if event.eta_s is not None:
+            text += f", ETA {event.eta_s:.0f}s"
+        if event.message:
+            text += f", {event.message}"
+        self.var_progress_text.set(text)
+
     def quit_app(self):
         self.log.info("root destroy triggered by user.")
+        self.jobs.shutdown()
         self.quit()
         self.destroy()
 
 
-def main(cfg):
+def main(cfg=None):
+    if cfg is None:
+        cfg = load_config(hard_reset="--reset" in sys.argv[1:])
     app = App(cfg)
     app.mainloop()
 
 
 if __name__ == "__main__":
-    main(cfg)
+    # required for the image preprocessing pool in frozen executables
+    multiprocessing.freeze_support()
+    main()
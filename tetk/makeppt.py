@@ -1,197 +1,701 @@
 from pathlib import Path
 import pandas as pd
-import copy
 import pptx
-from pptx.util import Cm, Pt
+from pptx.util import Cm, Emu
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.serialized import PackageWriter
+from pptx.opc.packuri import PackURI
+from pptx.opc.spec import image_content_types
+from pptx.parts.image import Image, ImagePart
 from itertools import zip_longest
-import PIL
 import math
+import os
+import zipfile
+import hashlib
 
 import commons as cf
+import perf
 from utils import PathFinder
+from imageprep import ImagePreprocessor
+from imageprobe import ImageInfo
+from manifest import DeckManifest, settings_digest
+from templatecache import load_template
+from jobrunner import JobCancelled
+from recipes import compile_layout
+from slidexml import PictureBatch
+from slidegrid import grid_shape, grid_slots, page_capacity, iter_pages
+
+# recipe keys that change how a slide looks, a change rebuilds the slide in incremental mode
+LAYOUT_SETTINGS_KEYS = [
+    "original_image_size",
+    "crop_coords",
+    "coor_x_origin",
+    "coor_y_origin",
+    "wafer_id_text_size",
+    "wafer_id_text_y_offset",
+    "wafer_id_textbox_width_cm",
+    "wafer_id_textbox_height_cm",
+    "wafer_id_legend_x_offset_cm",
+    "wafer_id_legend_y_offset_cm",
+    "wafer_id_single_txtbox_loc_offset_x_cm",
+    "wafer_id_single_txtbox_loc_offset_y_cm",
+    "wafer_id_single_txtbox_text_size_pt",
+    "embed_dpi",
+    "embed_png_colors",
+    "embed_png_optimize",
+    "wafer_id_single_size_width_cm",
+    "grid_lot",
+    "grid_single",
+    "max_images_per_slide",
+    "min_thumbnail_cm",
+    "picture_backend",
+]
+
+
+class _OpenZipWriter:
+    """Physical package writer on top of a zip file that is already open"""
+
+    def __init__(self, zipf: zipfile.ZipFile):
+        self.zipf = zipf
+
+    def write(self, pack_uri, blob: bytes):
+        self.zipf.writestr(pack_uri.membername, blob)
+
+
+class _StreamPackageWriter(PackageWriter):
+    """python-pptx PackageWriter that skips parts already streamed into the zip"""
+
+    def __init__(self, zipf: zipfile.ZipFile, pkg_rels, parts, flushed: set):
+        super().__init__(zipf, pkg_rels, parts)
+        self._flushed = flushed
+
+    def _write(self):
+        phys_writer = _OpenZipWriter(self._pkg_file)
+        self._write_content_types_stream(phys_writer)
+        self._write_pkg_rels(phys_writer)
+        self._write_parts(phys_writer)
+
+    def _write_parts(self, phys_writer):
+        for part in self._parts:
+            if part.partname not in self._flushed:
+                phys_writer.write(part.partname, part.blob)
+            if part._rels:
+                phys_writer.write(part.partname.rels_uri, part.rels.xml)
+
+
+class PptStreamWriter:
+    """
+    Streams image parts into the .pptx zip as soon as a slide is finished,
+    then releases the image bytes held by python-pptx.
+    Slide XML and the remaining parts are written on close.
+    Peak memory is one slide worth of images instead of the whole deck.
+
+    :param outpath: final .pptx path, a hidden .partial file is written until close
+    :type outpath: pathlib.Path
+    """
+
+    def __init__(self, log, outpath: Path):
+        self.log = log
+        self.outpath = outpath
+        self.partial_path = outpath.with_name(f".{outpath.name}.partial")
+        self.zipf = zipfile.ZipFile(
+            self.partial_path, "w", compression=zipfile.ZIP_DEFLATED
+        )
+        self.flushed = set()
+        self.bytes_flushed = 0
+
+    def flush_slide(self, slide):
+        with perf.span("zip_write"):
+            self._flush_slide(slide)
+
+    def _flush_slide(self, slide):
+        for rel in slide.part.rels.values():
+            if rel.is_external or rel.reltype != RT.IMAGE:
+                continue
+            part = rel.target_part
+            if part.partname in self.flushed:
+                continue
+            # python-pptx dedups images by sha1, cache it before the blob is released
+            part.sha1
+            # images are compressed already, deflating them again only costs time
+            self.zipf.writestr(
+                part.partname.membername, part.blob, compress_type=zipfile.ZIP_STORED
+            )
+            self.bytes_flushed += len(part.blob)
+            part._blob = b""
+            self.flushed.add(part.partname)
+
+    def close(self, prs, outpath: Path = None):
+        """
+        Writes the rest of the package and moves the file to its final name.
+        The presentation cannot be saved again afterwards, its image bytes are gone.
+        """
+        package = prs.part.package
+        parts = tuple(package.iter_parts())
+        with perf.span("zip_write"):
+            _StreamPackageWriter(self.zipf, package._rels, parts, self.flushed)._write()
+            self.zipf.close()
+        outpath = outpath or self.outpath
+        os.replace(self.partial_path, outpath)
+        self.log.debug(f"streamed {len(self.flushed)} images, {self.bytes_flushed=}")
+        return outpath
+
+
+class ImagePartIndex:
+    """
+    Image parts of a presentation by sha1 of their bytes.
+    python-pptx looks for an existing part by walking every relationship of the package
+    and picks a new partname by listing every part, for each picture added.
+    Here both are a dict lookup and a counter, seeded once from the package.
+
+    :param package: package of the presentation, `prs.part.package`
+    :type package: pptx.package.Package
+    """
+
+    def __init__(self, package):
+        self.package = package
+        self.parts = {}
+        last_idx = 0
+        for part in package.iter_parts():
+            if part.partname.startswith("/ppt/media/image") and part.partname.idx:
+                last_idx = max(last_idx, part.partname.idx)
+        for rel in package.iter_rels():
+            # pictures only, not the thumbnail
+            if rel.is_external or rel.reltype != RT.IMAGE:
+                continue
+            if isinstance(rel.target_part, ImagePart):
+                self.parts.setdefault(rel.target_part.sha1, rel.target_part)
+        self.next_idx = last_idx + 1
+
+    def get_or_add(self, blob: bytes, filename: str = None, info: ImageInfo = None):
+        """
+        Image part holding `blob`, a new part only if no part holds the same bytes.
+        The part is named from the probed `info`, PIL only opens formats the probe does not know.
+
+        :return: image part, True if it was created
+        :rtype: tuple[ImagePart, bool]
+        """
+        sha1 = hashlib.sha1(blob).hexdigest()
+        part = self.parts.get(sha1)
+        if part is not None:
+            return part, False
+        if info is not None and info.ext in image_content_types:
+            ext = info.ext
+        else:
+            ext = Image.from_blob(blob, filename).ext
+        partname = PackURI(f"/ppt/media/image{self.next_idx}.{ext}")
+        self.next_idx += 1
+        part = ImagePart(partname, image_content_types[ext], self.package, blob, filename)
+        self.parts[sha1] = part
+        return part, True
+
 
 class PptManager:
     def __init__(self, cfg: dict, filepath_template: Path) -> None:
         self.cfg = cfg
+        self.log = cfg.log
         assert filepath_template.is_file(), f"invalid {filepath_template=}"
-        self.root = pptx.Presentation(filepath_template)
+        self.filepath_template = filepath_template
+        self.root = load_template(
+            filepath_template,
+            cfg["template_cache_max_mb"] if "template_cache_max_mb" in cfg else None,
+        )
+        self.manifest = None
+        self.slide_keys = {}
+        self.preprocessor = ImagePreprocessor(cfg)
+        self.prepared = {}
+        self.image_parts = None
+        self.job = None
+        self.bytes_source = 0
+        self.bytes_placed = 0
+        self.bytes_embedded = 0
+        self.stream = None
+        # layout constants in EMU, compiled once per recipe
+        self.layout = getattr(cfg, "layout", None) or compile_layout(cfg)
+        if "streaming_output" in cfg and cfg["streaming_output"]:
+            self.open_stream()
+
+    def open_stream(self, outname=""):
+        """
+        Switches to streaming output, images are written out slide by slide.
+        `save_ppt` then completes the file, an outname given there renames it.
+
+        :param outname: name of output file, defaults to output-{time}.pptx
+        :type outname: str, optional
+        """
+        if not outname:
+            outname = f"output-{cf.get_time()}.pptx"
+        self.stream = PptStreamWriter(self.log, self.cfg.user_folders["outf01"] / outname)
+
+    def open_incremental(self, outname: str):
+        """
+        Switches to incremental output into a fixed `outname`.
+        If the deck and its manifest exist from a previous run, the previous deck is the
+        starting point and slides with unchanged inputs and settings are reused,
+        only the other slides are rebuilt.
+
+        :param outname: name of output file, reused on every run
+        :type outname: str
+        """
+        outpath = self.cfg.user_folders["outf01"] / outname
+        self.manifest = DeckManifest(self.log, outpath)
+        if self.manifest.load_previous(self.filepath_template):
+            self.root = pptx.Presentation(outpath)
+            self.image_parts = None
+            self.log.info(
+                f"incremental run, {len(self.manifest.previous)} slides on record in {outname}"
+            )
+        else:
+            self.manifest.template_slide_ids = [x.slide_id for x in self.root.slides]
+        if self.stream is not None:
+            self.stream.outpath = outpath
+
+    def tick(self, n: int = 1):
+        """
+        Checkpoint of the insert loops, reports `n` images done to the GUI job.
+        A cancelled job stops here, the partial output is discarded.
+        """
+        if self.job is None:
+            return
+        try:
+            self.job.advance(n)
+        except JobCancelled:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Stops the preprocessing pool and removes a partially streamed file"""
+        self.preprocessor.close()
+        self.prepared.clear()
+        if self.stream is not None:
+            self.stream.zipf.close()
+            self.stream.partial_path.unlink(missing_ok=True)
+            self.stream = None
+
+    def slide_key(self, name: str) -> str:
+        # the same name can be inserted more than once, keep the keys unique
+        count = self.slide_keys.get(name, 0)
+        self.slide_keys[name] = count + 1
+        return name if count == 0 else f"{name}#{count}"
+
+    def reuse_slide(self, slide_key: str, settings: str, imgpaths: list) -> bool:
+        """
+        Keeps the previous run's slide for `slide_key` if nothing changed (incremental mode)
+
+        :return: True if the slide was reused and must not be built
+        :rtype: bool
+        """
+        if self.manifest is None:
+            return False
+        inputs = self.manifest.fingerprints(imgpaths)
+        slide_id = self.manifest.reusable_slide_id(slide_key, settings, inputs)
+        if slide_id is None or self.root.slides.get(slide_id) is None:
+            return False
+        self.manifest.add_slide(slide_key, slide_id, settings, inputs)
+        self.log.debug(f"reused slide {slide_key}")
+        return True
+
+    def finish_slide(self, slide, slide_key: str, settings: str, imgpaths: list):
+        if self.stream is not None:
+            self.stream.flush_slide(slide)
+            # streaming keeps only the current slide worth of images in memory
+            self.release_prepared(imgpaths)
+        if self.manifest is not None:
+            inputs = self.manifest.fingerprints(imgpaths)
+            self.manifest.add_slide(slide_key, slide.slide_id, settings, inputs)
+
+    def release_prepared(self, imgpaths: list):
+        """Drops the prepared images of `imgpaths`, at every width they were prepared for"""
+        imgpaths = set(imgpaths)
+        for key in [x for x in self.prepared if x[0] in imgpaths]:
+            del self.prepared[key]
+
+    def apply_manifest(self):
+        """Drops outdated slides of the previous run and puts slides in build order"""
+        order = self.manifest.template_slide_ids + [
+            x["slide_id"] for x in self.manifest.slides
+        ]
+        sldIdLst = self.root.slides._sldIdLst
+        sldIds = {int(x.id): x for x in sldIdLst.sldId_lst}
+        dropped = 0
+        for slide_id, sldId in sldIds.items():
+            if slide_id not in order:
+                sldIdLst.remove(sldId)
+                self.root.part.drop_rel(sldId.rId)
+                dropped += 1
+        for slide_id in order:
+            # appending an existing element moves it to the end
+            sldIdLst.append(sldIds[slide_id])
+        self.log.info(f"incremental run, dropped {dropped} outdated slides")
 
     @staticmethod
     def split_list(list_in, no_of_chunks, fillvalue="none"):
         return zip_longest(*[iter(list_in)] * no_of_chunks, fillvalue=fillvalue)
 
-    def crop_image(
-        self, imgpath: Path, orignal_size=None, crop_coords=(0, 0, 0, 0)
-    ) -> bool:
-        if not imgpath.is_file():
-            raise Exception(f"invalid image path: {imgpath}")
-        img = PIL.Image.open(imgpath)
-        if orignal_size is not None:
-            if (img.size[0] == orignal_size[0]) and (img.size[1] == orignal_size[1]):
-                pass
+    def prepare_images(self, imgpaths: list, fixed_width=None, width_emu=None):
+        """
+        Crops, downsamples and re-encodes images on the preprocessing pool.
+        Call with all images upfront to use every worker,
+        the insert functions only prepare images that are not prepared yet.
+
+        :param imgpaths: list of image paths, invalid entries are ignored
+        :type imgpaths: list
+        :param fixed_width: placed width of the pictures in cm, used with `embed_dpi`
+        :type fixed_width: float, optional
+        :param width_emu: placed width in EMU, instead of `fixed_width`
+        :type width_emu: int, optional
+        """
+        width_px = self.preprocessor.width_px(width_emu or (fixed_width and Cm(fixed_width)))
+        todo = [
+            imgpath
+            for imgpath in dict.fromkeys(imgpaths)
+            if isinstance(imgpath, Path) and (imgpath, width_px) not in self.prepared
+        ]
+        for prepared in self.preprocessor.run(todo, width_px=width_px):
+            self.prepared[(prepared.filepath, width_px)] = prepared
+
+    def picture_batch(self, slide):
+        """
+        Batch collecting the pictures of `slide` for the XML backend,
+        None with `picture_backend: pptx`, pictures are then added one by one by python-pptx
+        """
+        backend = self.cfg["picture_backend"] if "picture_backend" in self.cfg else "xml"
+        return PictureBatch(slide) if backend == "xml" else None
+
+    def emit_pictures(self, batch):
+        """Adds the batched pictures to their slide, falls back to python-pptx if that fails"""
+        if batch is None or not len(batch):
+            return
+        with perf.span("emit_pictures"):
+            try:
+                batch.emit()
+            except Exception as e:
+                self.log.warning(f"picture XML emission failed, using python-pptx; {e}")
+                slide = batch.slide
+                for image_part, left, top, width, height in batch.pictures:
+                    rId = slide.part.relate_to(image_part, RT.IMAGE)
+                    slide.shapes._add_pic_from_image_part(
+                        image_part, rId, left, top, width, height
+                    )
+                batch.pictures = []
+
+    def add_prepared_picture(self, slide, imgpath: Path, left, top, width, batch=None):
+        with perf.span("add_picture"):
+            picture = self._add_prepared_picture(slide, imgpath, left, top, width, batch)
+        perf.count("images_added")
+        return picture
+
+    def _add_prepared_picture(self, slide, imgpath: Path, left, top, width, batch=None):
+        prepared = self.prepared.get((imgpath, self.preprocessor.width_px(width)))
+        if prepared is None:
+            raise Exception(f"image not prepared: {imgpath}")
+        if self.image_parts is None:
+            self.image_parts = ImagePartIndex(self.root.part.package)
+        # dedup on the prepared bytes, the same wafer cropped the same way is stored once
+        image_part, is_new = self.image_parts.get_or_add(
+            prepared.blob, prepared.filepath.name, prepared.info
+        )
+        self.bytes_source += prepared.source_size
+        self.bytes_placed += len(prepared.blob)
+        if is_new:
+            self.bytes_embedded += len(prepared.blob)
+        # height from the probed header, python-pptx then skips its own scaling
+        info = prepared.info
+        height = Emu(round(width * info.height / info.width))
+        if batch is not None:
+            # placed by emit_pictures() together with the rest of the slide
+            batch.add(image_part, left, top, width, height)
+            return None
+        # same as shapes.add_picture, with the image part from the index
+        rId = slide.part.relate_to(image_part, RT.IMAGE)
+        pic = slide.shapes._add_pic_from_image_part(
+            image_part, rId, left, top, width, height
+        )
+        return slide.shapes._shape_factory(pic)
+
+    def lot_area(self) -> tuple:
+        """Free area of a lot page in EMU, from the origin to the legend and the bottom edge"""
+        layout = self.layout
+        width = layout.legend_x_offset or self.root.slide_width - 2 * layout.x_origin
+        return width, self.root.slide_height - layout.y_origin
+
+    def single_area(self) -> tuple:
+        """Free area of a single wafer page in EMU, from the origin to the right edge and the legend"""
+        layout = self.layout
+        height = layout.single_legend_y_offset or self.root.slide_height - layout.y_origin
+        return self.root.slide_width - layout.x_origin, height
+
+    def lot_page_size(self) -> int:
+        """Images per lot page from `max_images_per_slide` and `min_thumbnail_cm`, 0 if unlimited"""
+        min_cm = self.cfg["min_thumbnail_cm"] if "min_thumbnail_cm" in self.cfg else 0
+        max_images = (
+            self.cfg["max_images_per_slide"] if "max_images_per_slide" in self.cfg else 0
+        )
+        return page_capacity(
+            self.layout.grid_lot, self.lot_area(), min_cell=Cm(min_cm), max_slots=max_images
+        )
+
+    def lot_slots(self, n: int):
+        """Slots of a lot page of `n` images, see slidegrid.grid_slots"""
+        layout = self.layout
+        origin = (layout.x_origin, layout.y_origin)
+        return grid_slots(n, layout.grid_lot, origin, self.lot_area(), "row")
+
+    def prepare_lots(self, data: dict):
+        """
+        Prepares the images of every lot page upfront, at the width its page places them,
+        so that the preprocessing pool works on all images at once.
+        Streaming and incremental runs prepare page by page instead.
+
+        :param data: image paths by group name, e.g. from `FileManager.construct_lotPerPage`
+        :type data: dict[str, list]
+        """
+        if self.stream is not None or self.manifest is not None:
+            return
+        page_size = self.lot_page_size()
+        by_width = {}
+        for images in data.values():
+            for page in iter_pages(images, page_size):
+                if not page:
+                    continue
+                width_emu = int(self.lot_slots(len(page))[0, 2])
+                width_px = self.preprocessor.width_px(width_emu)
+                by_width.setdefault(width_px, (width_emu, []))[1].extend(page)
+        for width_emu, imgpaths in by_width.values():
+            self.prepare_images(imgpaths, width_emu=width_emu)
+
+    def insert_images_wafersPerLot(self, name: str, images):
+        """
+        Adds the images of `name` on the recipe `grid_lot`, spread over as many slides
+        as `lot_page_size()` needs. Pages are taken from `images` one at a time,
+        continuation slides are titled e.g. `LOT01 (2/3)` and get their own legend.
+
+        :param name: group name, shown in the title
+        :type name: str
+        :param images: image paths in slot order, a list or any iterable
+        :type images: list[pathlib.Path]
+        """
+        page_size = self.lot_page_size()
+        n_pages = None
+        if hasattr(images, "__len__"):
+            n_pages = math.ceil(len(images) / page_size) if page_size else 1
+        for page_no, page in enumerate(iter_pages(images, page_size), start=1):
+            if n_pages == 1:
+                page_title = name
+            elif n_pages is not None:
+                page_title = f"{name} ({page_no}/{n_pages})"
             else:
-                self.cfg.log.debug(f"Skip crop. Non-original img: {imgpath.name}")
-                return False
+                page_title = f"{name} (cont. {page_no})" if page_no > 1 else name
+            key = f"lot::{name}" if page_no == 1 else f"lot::{name}::page{page_no}"
+            self.insert_lot_page(page_title, page, key)
 
-        cropped_img = img.crop(crop_coords)
-        cropped_img.save(imgpath)
-        self.cfg.log.info(f"Cropped and overridden image: {imgpath.name}")
-        return True
+    def insert_lot_page(self, page_title: str, images: list, slide_key: str):
+        """
+        Adds one lot slide, the images on the recipe `grid_lot`
 
-    def insert_images_wafersPerLot(
-        self, name: str, images: list, stepsize_x=3, stepsize_y=3, fixed_width=3
-    ):
+        :param page_title: slide title
+        :type page_title: str
+        :param images: image paths, in slot order
+        :type images: list[pathlib.Path]
+        :param slide_key: key of the slide in the incremental manifest
+        :type slide_key: str
+        """
         log = self.cfg.log
         root = self.root
+        layout = self.layout
+        grid = layout.grid_lot
+        area = self.lot_area()
+        # the title carries the page count, a lot growing onto a second page renames page 1
+        settings = settings_digest(
+            self.cfg,
+            LAYOUT_SETTINGS_KEYS,
+            layout="wafersPerLot",
+            area=area,
+            title=page_title,
+        )
+        slide_key = self.slide_key(slide_key)
+        imgpaths = images
+        if self.reuse_slide(slide_key, settings, imgpaths):
+            self.tick(len(imgpaths))
+            return
+        self.tick(0)
         print(f"{root.slide_layouts=}")
         slide = root.slides.add_slide(root.slide_layouts[0])
-        cols = math.ceil(math.sqrt(len(images)))
         n = len(images)
-        images = list(self.split_list(images, cols))
-        legend_text = "Legend:\n"
-        coor_x_start = self.cfg["coor_x_origin"]
-        coor_x = copy.copy(coor_x_start)
-        coor_y_start = self.cfg["coor_y_origin"]
-        coor_y = copy.copy(coor_y_start)
+        cols, _ = grid_shape(n, grid)
+        slots = self.lot_slots(n)
+        batch = self.picture_batch(slide)
+        if n:
+            self.prepare_images(images, width_emu=int(slots[0, 2]))
 
         title_txtbox = slide.shapes.add_textbox(
-            Cm(coor_x_start),
-            Cm(coor_y_start + self.cfg["wafer_id_text_y_offset"]),
-            width=Cm(self.cfg["wafer_id_textbox_width_cm"]),
-            height=Cm(self.cfg["wafer_id_textbox_height_cm"]),
+            layout.x_origin,
+            layout.y_origin + layout.title_y_offset,
+            width=layout.title_width,
+            height=layout.title_height,
         )
         title = title_txtbox.text_frame.paragraphs[0]
-        title.text = f"{name}: {n} wafer images "
-        title.font.size = Pt(self.cfg["wafer_id_text_size"])
+        title.text = f"{page_title}: {n} wafer images "
+        title.font.size = layout.title_font_size
 
-        image_counter = 0
-        for row in images:
-            for imgpath in row:
-                if not imgpath or imgpath == "none":
-                    continue
-                self.crop_image(
-                    imgpath,
-                    orignal_size=self.cfg["original_image_size"],
-                    crop_coords=self.cfg["crop_coords"],
-                )
-                slide.shapes.add_picture(
-                    str(imgpath.resolve()),
-                    left=Cm(coor_x),
-                    top=Cm(coor_y),
-                    width=Cm(fixed_width),
+        legend_text = "Legend:\n"
+        for i, (imgpath, (left, top, width, _)) in enumerate(zip(images, slots.tolist())):
+            try:
+                self.add_prepared_picture(
+                    slide, imgpath, left=left, top=top, width=width, batch=batch
                 )
-                wafer_id = imgpath.name
-                try:
-                    wafer_id = int(wafer_id)
-                except Exception:
-                    wafer_id = 0
-                legend_text += f" {wafer_id:02d}"
-                log.debug(f"added {imgpath.name=}")
-                coor_x += stepsize_x
-                image_counter += 1
-            legend_text += "\n"
-
-            coor_y += stepsize_y
-            coor_x = copy.copy(coor_x_start)
+            except Exception as e:
+                log.error(f"insert_images_wafersPerLot(); {e=}")
+            self.tick()
+            wafer_id = imgpath.name
+            try:
+                wafer_id = int(wafer_id)
+            except Exception:
+                wafer_id = 0
+            legend_text += f" {wafer_id:02d}"
+            log.debug(f"added {imgpath.name=}")
+            if (i + 1) % cols == 0 or i == n - 1:
+                legend_text += "\n"
+        self.emit_pictures(batch)
 
         legend_txtbox = slide.shapes.add_textbox(
-            Cm(coor_x_start + self.cfg["wafer_id_legend_x_offset_cm"]),
-            Cm(coor_y_start + self.cfg["wafer_id_legend_y_offset_cm"]),
+            layout.x_origin + layout.legend_x_offset,
+            layout.y_origin + layout.legend_y_offset,
             width=Cm(3),
             height=Cm(3),
         )
         legend_txtbox.text_frame.word_wrap = False
         legend = legend_txtbox.text_frame.paragraphs[0]
         legend.text = legend_text
-        legend.font.size = Pt(self.cfg["wafer_id_text_size"])
+        legend.font.size = layout.title_font_size
         legend.font.name = "Courier"
+        self.finish_slide(slide, slide_key, settings, imgpaths)
+
+    def insert_images_singleWaferCompare(self, df: pd.DataFrame):
+        """
+        Adds slides comparing each wafer across folders on the recipe `grid_single`,
+        a column per wafer and a row per folder, `grid_single.cols` wafers per slide
 
-    def insert_images_singleWaferCompare(
-        self, df: pd.DataFrame, cols=4, stepsize_x=6, stepsize_y=6, fixed_width=6
-    ):
+        :param df: image paths, a row per wafer and a column per folder
+        :type df: pd.DataFrame
+        """
         root = self.root
+        layout = self.layout
         foldernames = list(df.columns)
-        col_count = 0
-        legend_headerTop = []
-        legend_headerBtm = []
-        legend_firstRow = []
-        legend_secondRow = []
-
-        coor_x_start = self.cfg["coor_x_origin"]
-        coor_x = copy.copy(coor_x_start)
-        coor_y_start = self.cfg["coor_y_origin"]
-        coor_y = copy.copy(coor_y_start)
-
-        for i, (ind, row) in enumerate(df.iterrows()):
-            if col_count == 0:
-                slide = root.slides.add_slide(root.slide_layouts[3])
-                coor_x = copy.copy(coor_x_start)
-                coor_y = copy.copy(coor_y_start)
-
-            for j, foldername in enumerate(foldernames):
-                imgpath = row[foldername]
-                try:
-                    self.crop_image(
-                        imgpath,
-                        orignal_size=self.cfg["original_image_size"],
-                        crop_coords=self.cfg["crop_coords"],
-                    )
-                    slide.shapes.add_picture(
-                        str(imgpath.resolve()),
-                        left=Cm(coor_x),
-                        top=Cm(coor_y),
-                        width=Cm(fixed_width),
-                    )
-                except Exception as e:
-                    self.log.error(f"insert_images_singleWaferCompare(); {e=}")
-                if j == 0:
-                    legend_headerTop.append("::".join(ind))
-                    legend_firstRow.append(foldername)
-                    coor_y += stepsize_y
-                else:
-                    legend_headerBtm.append("::".join(ind))
-                    legend_secondRow.append(foldername)
-                    coor_x += stepsize_x
-                    coor_y -= stepsize_y
-
-            self.cfg.log.info(
-                f"singleRun{i:03d}: {ind}, {foldernames[0]}={bool(row[foldernames[0]])} {foldernames[1]}={bool(row[foldernames[1]])}"
-            )
+        grid = layout.grid_single
+        grid = grid._replace(rows=grid.rows or len(foldernames))
+        cols = grid.cols or max(len(df), 1)
+        grid = grid._replace(cols=cols)
+        area = self.single_area()
+        # every page uses the slots of a full page, a short last page lines up with the others
+        slots = grid_slots(
+            cols * grid.rows, grid, (layout.x_origin, layout.y_origin), area, "col"
+        ).tolist()
+        width_emu = slots[0][2] if slots else None
+        settings = settings_digest(
+            self.cfg,
+            LAYOUT_SETTINGS_KEYS,
+            layout="singleWaferCompare",
+            foldernames=foldernames,
+            area=area,
+        )
+        if self.stream is None and self.manifest is None:
+            self.prepare_images(df.to_numpy().ravel().tolist(), width_emu=width_emu)
 
-            col_count += 1
-            if col_count == 4 or i == len(df) - 1:
-                col_count = 0
-                legend_txtbox = slide.shapes.add_textbox(
-                    Cm(
-                        coor_x_start
-                        + self.cfg["wafer_id_single_txtbox_loc_offset_x_cm"]
-                    ),
-                    Cm(
-                        coor_y_start
-                        + self.cfg["wafer_id_single_txtbox_loc_offset_y_cm"]
-                    ),
-                    width=Cm(3),
-                    height=Cm(3),
-                )
-                legend = legend_txtbox.text_frame.paragraphs[0]
-                legend_headerTop = [f"{v:^13}" for v in legend_headerTop]
-                legend_firstRow = [f"{v:^13}" for v in legend_firstRow]
-                legend_secondRow = [f"{v:^13}" for v in legend_secondRow]
-                legend.text = f"Legend:\n{' '.join(legend_headerTop)}\n{' '.join(legend_firstRow)}\n{' '.join(legend_secondRow)}"
-                legend.font.size = Pt(self.cfg["wafer_id_single_txtbox_text_size_pt"])
-                legend.font.name = "Courier"
-                legend_txtbox.text_frame.word_wrap = False
-                legend_headerTop = []
-                legend_headerBtm = []
-                legend_firstRow = []
-                legend_secondRow = []
+        for page_start in range(0, len(df), cols):
+            page = df.iloc[page_start : page_start + cols]
+            page_imgpaths = page.to_numpy().ravel().tolist()
+            page_name = "::".join(str(x) for x in page.index[0])
+            slide_key = self.slide_key(f"single::{page_name}")
+            if self.reuse_slide(slide_key, settings, page_imgpaths):
+                self.tick(len(page_imgpaths))
+                continue
+            self.tick(0)
+            slide = root.slides.add_slide(root.slide_layouts[3])
+            batch = self.picture_batch(slide)
+            self.prepare_images(page_imgpaths, width_emu=width_emu)
+
+            legend_header = []
+            for i, (ind, row) in enumerate(page.iterrows()):
+                for j, foldername in enumerate(foldernames):
+                    left, top, width, _ = slots[i * grid.rows + j]
+                    try:
+                        self.add_prepared_picture(
+                            slide,
+                            row[foldername],
+                            left=left,
+                            top=top,
+                            width=width,
+                            batch=batch,
+                        )
+                    except Exception as e:
+                        self.log.error(f"insert_images_singleWaferCompare(); {e=}")
+                    self.tick()
+                legend_header.append("::".join(str(x) for x in ind))
+                found = " ".join(f"{x}={bool(row[x])}" for x in foldernames)
+                self.cfg.log.info(f"singleRun{page_start + i:03d}: {ind}, {found}")
+            self.emit_pictures(batch)
+
+            legend_txtbox = slide.shapes.add_textbox(
+                layout.x_origin + layout.single_legend_x_offset,
+                layout.y_origin + layout.single_legend_y_offset,
+                width=Cm(3),
+                height=Cm(3),
+            )
+            legend = legend_txtbox.text_frame.paragraphs[0]
+            legend_lines = [" ".join(f"{v:^13}" for v in legend_header)]
+            for foldername in foldernames:
+                legend_lines.append(" ".join([f"{foldername:^13}"] * len(legend_header)))
+            legend.text = "Legend:\n" + "\n".join(legend_lines)
+            legend.font.size = layout.single_legend_font_size
+            legend.font.name = "Courier"
+            legend_txtbox.text_frame.word_wrap = False
+            self.finish_slide(slide, slide_key, settings, page_imgpaths)
 
     def save_ppt(self, outname=""):
-        if not outname:
-            outname = f"output-{cf.get_time()}.pptx"
-        outpath = self.cfg.user_folders["outf01"] / outname
-        self.root.save(outpath)
+        with perf.span("save"):
+            outpath = self._save_ppt(outname)
+        perf.count("bytes_written", outpath.stat().st_size)
+        return outpath
+
+    def _save_ppt(self, outname=""):
+        if self.manifest is not None:
+            outname = outname or self.manifest.deckpath.name
+            self.apply_manifest()
+        if self.stream is not None:
+            outpath = self.stream.outpath
+            if outname:
+                outpath = self.cfg.user_folders["outf01"] / outname
+            self.stream.close(self.root, outpath)
+            self.stream = None
+        else:
+            if not outname:
+                outname = f"output-{cf.get_time()}.pptx"
+            outpath = self.cfg.user_folders["outf01"] / outname
+            with perf.span("zip_write"):
+                self.root.save(outpath)
+        self.preprocessor.close()
+        self.prepared.clear()
+        self.log_embedding_report()
         cf.output(self.cfg.log, outpath)
+        if self.manifest is not None:
+            self.manifest.save(outpath)
+        return outpath
+
+    def log_embedding_report(self):
+        saved = self.bytes_source - self.bytes_embedded
+        ratio = saved / self.bytes_source if self.bytes_source else 0
+        self.log.info(
+            f"images embedded {self.bytes_embedded / 1e6:.2f}MB "
+            f"from {self.bytes_source / 1e6:.2f}MB source, "
+            f"saved {saved / 1e6:.2f}MB ({ratio:.0%})"
+        )
+        deduped = self.bytes_placed - self.bytes_embedded
+        dedup_ratio = deduped / self.bytes_placed if self.bytes_placed else 0
+        self.log.info(
+            f"image dedup: {self.bytes_placed / 1e6:.2f}MB placed, "
+            f"{deduped / 1e6:.2f}MB shared between pictures ({dedup_ratio:.0%})"
+        )
 
 
 def makeppt(cfg):
@@ -220,6 +724,6 @@ def makeppt(cfg):
 
 
 if __name__ == "__main__":
-    from main import cfg
+    import config
 
-    makeppt(cfg)
+    makeppt(config.update_config_details(config.Config(hard_reset=False)))
@@ -0,0 +1,140 @@
+import json
+import hashlib
+from pathlib import Path
+
+
+MANIFEST_VERSION = 1
+
+
+def settings_digest(cfg: dict, keys: list, **kwargs) -> str:
+    """
+    Digest of the layout settings a slide is built from.
+    Recipe values of `keys` and the insert function arguments are hashed together.
+
+    :param cfg: configuration
+    :type cfg: config.Config
+    :param keys: recipe keys affecting the slide layout
+    :type keys: list
+    :return: hex digest
+    :rtype: str
+    """
+    settings = {key: cfg[key] for key in keys if key in cfg}
+    settings.update(kwargs)
+    payload = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class DeckManifest:
+    """
+    Maps every slide of an output deck to the input files and layout settings it was built from.
+    Saved as `<deck>.manifest.json` next to the deck in the output folder,
+    so that a rerun can reuse slides whose inputs and settings did not change.
+
+    :param deckpath: path of the output .pptx
+    :type deckpath: pathlib.Path
+    """
+
+    def __init__(self, log, deckpath: Path):
+        self.log = log
+        self.deckpath = deckpath
+        self.path = deckpath.with_suffix(".manifest.json")
+        self.template = None
+        self.template_slide_ids = []
+        self.slides = []
+        self.previous = {}
+        self._fingerprints = {}
+
+    def load_previous(self, template: Path) -> bool:
+        """
+        Loads the manifest of the previous run, if it and its deck still exist
+        and the deck was built from the same template
+
+        :param template: template the deck is built from
+        :type template: pathlib.Path
+        :return: True if a previous manifest was loaded
+        :rtype: bool
+        """
+        self.template = self.fingerprint(template)
+        if not (self.path.is_file() and self.deckpath.is_file()):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log.warning(f"manifest unreadable, full rebuild; {e=}")
+            return False
+        if data.get("version") != MANIFEST_VERSION:
+            return False
+        if data["template"]["hash"] != self.template["hash"]:
+            self.log.info("template changed, full rebuild")
+            return False
+
+        self.template_slide_ids = data["template_slide_ids"]
+        self.previous = {slide["key"]: slide for slide in data["slides"]}
+        for slide in data["slides"]:
+            for record in slide["inputs"]:
+                self._fingerprints[record["path"]] = record
+        return True
+
+    def fingerprint(self, filepath: Path) -> dict:
+        """
+        Returns path, mtime, size and hash of an input file.
+        The file is only hashed again if its mtime or size differs from the previous run.
+        """
+        key = str(filepath)
+        stat = filepath.stat()
+        previous = self._fingerprints.get(key)
+        if (
+            previous is not None
+            and previous["mtime"] == stat.st_mtime
+            and previous["size"] == stat.st_size
+        ):
+            return previous
+        record = {
+            "path": key,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "hash": hashlib.sha1(filepath.read_bytes()).hexdigest(),
+        }
+        self._fingerprints[key] = record
+        return record
+
+    def fingerprints(self, imgpaths: list) -> list[dict]:
+        return [self.fingerprint(x) for x in imgpaths if isinstance(x, Path)]
+
+    def reusable_slide_id(self, key: str, settings: str, inputs: list[dict]):
+        """
+        Slide id of the previous run's slide for `key`, if its inputs and settings are unchanged
+
+        :return: slide id in the previous deck, None if the slide must be rebuilt
+        :rtype: int | None
+        """
+        previous = self.previous.get(key)
+        if previous is None or previous["settings"] != settings:
+            return None
+        old_hashes = [(x["path"], x["hash"]) for x in previous["inputs"]]
+        new_hashes = [(x["path"], x["hash"]) for x in inputs]
+        if old_hashes != new_hashes:
+            return None
+        return previous["slide_id"]
+
+    def add_slide(self, key: str, slide_id: int, settings: str, inputs: list[dict]):
+        self.slides.append(
+            {"key": key, "slide_id": slide_id, "settings": settings, "inputs": inputs}
+        )
+
+    def save(self, deckpath: Path = None):
+        """Saves the manifest next to the deck, `deckpath` if it was saved under another name"""
+        if deckpath is not None:
+            self.deckpath = deckpath
+            self.path = deckpath.with_suffix(".manifest.json")
+        data = {
+            "version": MANIFEST_VERSION,
+            "deck": self.deckpath.name,
+            "template": self.template,
+            "template_slide_ids": self.template_slide_ids,
+            "slides": self.slides,
+        }
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        self.log.debug(f"manifest saved, {len(self.slides)} slides")
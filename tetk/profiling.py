@@ -0,0 +1,118 @@
+import io
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# frames of the profiler itself, left out of the allocation report
+ALLOC_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def run_id(name: str) -> str:
+    return f"{name}-profile-{time.strftime('%Y%m%d_%H%M%S')}"
+
+
+def write_profile(profiler: cProfile.Profile, folder: Path, stem: str, top_n: int = 30):
+    """
+    Writes the raw .prof, for snakeviz or `python -m pstats`, and a text summary
+    of the top functions by cumulative and by own time
+
+    :return: .prof and summary paths
+    :rtype: tuple[pathlib.Path, pathlib.Path]
+    """
+    prof_path = folder / f"{stem}.prof"
+    profiler.dump_stats(prof_path)
+
+    buffer = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buffer).strip_dirs()
+    for sort_key in ("cumulative", "tottime"):
+        buffer.write(f"==== top {top_n} by {sort_key} ====\n")
+        stats.sort_stats(sort_key).print_stats(top_n)
+    stats_path = folder / f"{stem}-stats.txt"
+    stats_path.write_text(buffer.getvalue(), encoding="utf-8")
+    return prof_path, stats_path
+
+
+def write_allocations(
+    before: tracemalloc.Snapshot,
+    after: tracemalloc.Snapshot,
+    peak: int,
+    folder: Path,
+    stem: str,
+    top_n: int = 30,
+) -> Path:
+    """
+    Writes the top allocation sites still alive at the end of the run,
+    and the sites that grew the most during the run
+
+    :return: path of the report
+    :rtype: pathlib.Path
+    """
+    before = before.filter_traces(ALLOC_FILTERS)
+    after = after.filter_traces(ALLOC_FILTERS)
+    lines = [f"peak traced memory: {peak / 1024**2:.1f} MB", ""]
+    lines.append(f"==== top {top_n} allocation sites at the end of the run ====")
+    for stat in after.statistics("lineno")[:top_n]:
+        lines.append(str(stat))
+    lines.append("")
+    lines.append(f"==== top {top_n} growth during the run ====")
+    for stat in after.compare_to(before, "lineno")[:top_n]:
+        lines.append(str(stat))
+    alloc_path = folder / f"{stem}-alloc.txt"
+    alloc_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return alloc_path
+
+
+@contextmanager
+def profile_run(cfg: dict, name: str):
+    """
+    Runs the body under cProfile and tracemalloc if `profile_mode` is on,
+    the reports are written to `outf02` under a run ID, e.g. `prod_run-profile-20240101_120000`.
+    Only the calling thread is profiled, not the image preprocessing worker processes,
+    their share shows as the time spent waiting in `ImagePreprocessor.run`.
+
+    :param cfg: configuration, uses `profile_mode`, `profile_top_n`, `profile_trace_frames`
+    :type cfg: config.Config
+    :param name: name of the run, prefix of the run ID
+    :type name: str
+    """
+    if not (cfg is not None and "profile_mode" in cfg and cfg["profile_mode"]):
+        yield
+        return
+    # another run is already profiled, e.g. classtimer inside a profiled CLI build
+    if tracemalloc.is_tracing():
+        yield
+        return
+
+    log = cfg.log
+    top_n = cfg["profile_top_n"] if "profile_top_n" in cfg else 30
+    frames = cfg["profile_trace_frames"] if "profile_trace_frames" in cfg else 1
+    stem = run_id(name)
+    log.info(f"profiling {name}, run ID {stem}")
+
+    tracemalloc.start(frames)
+    before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        folder = cfg.user_folders["outf02"]
+        try:
+            prof_path, _ = write_profile(profiler, folder, stem, top_n)
+            write_allocations(before, after, peak, folder, stem, top_n)
+            log.info(f"profile > created //{folder.name}/{prof_path.name}")
+        except Exception as e:
+            log.error(f"write profile failed; {e}")
@@ -1,8 +1,12 @@
-from collections import namedtuple
 import pandas as pd
+import numpy as np
 from pathlib import Path
+import os
+from collections.abc import Iterator
 from commons import get_time
-from utils import PathFinder
+from utils import PathFinder, scan_files
+from fileindex import get_file_index
+import perf
 # pd.set_option("display.max_columns", None)
 # pd.set_option("display.max_rows", None)
 
@@ -20,6 +24,85 @@ class DataInfo(dict):
                 self.update(data_)
 
 
+# page_by: one page per unique combination, sort_by: order of images within a page,
+# name_by: fields joined with "::" into the page name, they must tell every page_by key
+# apart (temp is parsed from the foldername) or pages with the same name replace each other
+PAGE_STRATEGIES = {
+    "lotPerPage": {
+        "page_by": ["product_id", "temp", "lot_id"],
+        "sort_by": ["wafer_id"],
+        "name_by": ["foldername", "product_id", "lot_id"],
+    },
+    "tempPerPage": {
+        "page_by": ["product_id", "lot_id", "wafer_id"],
+        "sort_by": ["temp"],
+        "name_by": ["product_id", "lot_id", "wafer_id"],
+    },
+}
+
+
+# fields converted to integers unless the recipe lists its own `numeric_fields`
+NUMERIC_FIELDS = ("wafer_id", "temp")
+
+
+def _typed_column(values: pd.Series, numeric: bool = False) -> pd.Series:
+    # numeric fields (wafer, temperature) become ints, the rest categoricals so that
+    # ids such as lot 00123 keep their leading zeros;
+    # fields repeat a lot, so only the categories are checked and converted
+    values = values.astype("category")
+    if not numeric:
+        return values
+    numbers = pd.to_numeric(values.cat.categories.to_series(), errors="coerce")
+    if numbers.notna().all() and (numbers % 1 == 0).all():
+        numbers = pd.to_numeric(numbers.to_numpy(), downcast="integer")
+        return pd.Series(numbers[values.cat.codes], index=values.index)
+    return values
+
+
+def parse_filenames(
+    df: pd.DataFrame,
+    filename_pattern: str,
+    foldername_pattern: str = "",
+    numeric_fields=NUMERIC_FIELDS,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Parses fields from file and folder names into typed columns, vectorised with str.extract.
+    Every named group of the patterns becomes a column, e.g. product_id, lot_id, wafer_id, temp.
+    Folder names repeat a lot, they are parsed once per unique name.
+
+    :param df: file table with `filename` and `foldername` columns
+    :type df: pd.DataFrame
+    :param filename_pattern: regex with named groups, matched from the start of the file name
+    :type filename_pattern: str
+    :param foldername_pattern: regex with named groups, matched from the start of the
+        folder name, defaults to ""
+    :type foldername_pattern: str, optional
+    :param numeric_fields: fields converted to integers when all their values are whole numbers,
+        defaults to NUMERIC_FIELDS
+    :type numeric_fields: list, optional
+    :return: rows that matched with the parsed columns added, rows that did not match
+    :rtype: tuple[pd.DataFrame, pd.DataFrame]
+    """
+    # str.extract searches anywhere in the name, anchor the patterns to its start
+    parsed = [df["filename"].str.extract(f"^(?:{filename_pattern})")]
+    if foldername_pattern:
+        folders = df["foldername"].astype("category")
+        per_folder = pd.Series(folders.cat.categories).str.extract(f"^(?:{foldername_pattern})")
+        folder_fields = per_folder.iloc[folders.cat.codes]
+        folder_fields.index = df.index
+        parsed.append(folder_fields)
+    parsed = pd.concat(parsed, axis=1)
+
+    matched = parsed.notna().all(axis=1)
+    out = df[matched].copy()
+    for column in parsed.columns:
+        out[column] = _typed_column(
+            parsed.loc[matched, column], numeric=column in numeric_fields
+        )
+    out["foldername"] = out["foldername"].astype("category")
+    return out.reset_index(drop=True), df[~matched]
+
+
 class FileManager:
     """
     FileManager
@@ -34,24 +117,30 @@ class FileManager:
         self.fileext = fileext
         assert folderpath.is_dir(), f"{folderpath.is_dir() = }"
         self.folderpath = folderpath
-
-        self.FileTableStructure = namedtuple("Data", "foldername filename filepath")
-        # self.get_filetable(self.folderpath)
+        self.get_filetable(self.folderpath)
 
     def get_filetable(self, folderpath: Path) -> pd.DataFrame:
         self.log.debug(f"input folder is {folderpath.resolve()}")
 
-        datalist = []
-        for filepath in folderpath.rglob(self.fileext):
-            datalist.append(
-                self.FileTableStructure(
-                    foldername=filepath.parent.name,
-                    filename=filepath.name,
-                    filepath=filepath,
-                )
+        index = get_file_index(self.cfg)
+        if index is not None:
+            table = index.scan(folderpath, exts=(), include=self.fileext)
+        else:
+            table = scan_files(
+                folderpath,
+                exts=(),
+                include=self.fileext,
+                workers=self.cfg["scan_workers"],
             )
-
-        df = pd.DataFrame(datalist)
+        df = pd.DataFrame(
+            {
+                "foldername": [os.path.basename(x) for x in table.folder],
+                "filename": table.name,
+                "filepath": [Path(f, n) for f, n in zip(table.folder, table.name)],
+                "size": table.size,
+                "mtime": table.mtime,
+            }
+        )
         if df.empty:
             raise ValueError(
                 "empty dataframe. is `input_validation` configured correctly?"
@@ -59,35 +148,121 @@ class FileManager:
         # df = df[df["foldername"].isin(self.cfg["input_validation"])]
         # df["throwaway"] = df["filename"].apply(lambda x: len(x.split("_")))
         # df = df[df["throwaway"] < self.cfg["throwaway_threshold"]]
-        # df["temp"] = df["foldername"].apply(lambda x: x.replace("C", ""))
-        # df["temp"] = pd.to_numeric(df["temp"], downcast="integer", errors="coerce")
-        # df["product_id"] = df["filename"].apply(lambda x: x.split("_")[0])
-        # df["lot_id"] = df["filename"].apply(lambda x: x.split("_")[1])
-        # df["wafer_id"] = df["filename"].apply(lambda x: x.split("_")[2].split("-")[1])
 
-        self.df = df
+        self.df = self.parse_filetable(df)
+        return self.df
+
+    def parse_filetable(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the fields parsed with the recipe `filename_pattern` and `foldername_pattern`,
+        files that do not match are reported and left out
+
+        :param df: file table from get_filetable
+        :type df: pd.DataFrame
+        :return: file table with product_id, lot_id, wafer_id, temp columns
+        :rtype: pd.DataFrame
+        """
+        with perf.span("parse"):
+            parsed, unmatched = parse_filenames(
+                df,
+                self.cfg["filename_pattern"],
+                self.cfg["foldername_pattern"],
+                self.cfg["numeric_fields"] if "numeric_fields" in self.cfg else NUMERIC_FIELDS,
+            )
+        if not unmatched.empty:
+            self.log.warning(
+                f"{len(unmatched)} of {len(df)} files do not match the filename patterns, "
+                f"e.g. {unmatched['filename'].iloc[0]}"
+            )
+            if self.cfg["debug_mode"]:
+                outname = f"unmatched_filenames-{get_time()}.csv"
+                outpath = self.cfg["user_folders"]["outf02"] / outname
+                unmatched.to_csv(outpath)
+                self.log.info(f"debug > created //{outpath.parent.name}/{outpath.name}")
+        if parsed.empty:
+            raise ValueError(
+                "no file matched. is `filename_pattern` configured correctly?"
+            )
+        self.unmatched = unmatched
+        return parsed
+
+    def page_strategy(self, strategy: str, sort_by: list = None) -> dict:
+        """
+        Grouping of a page strategy, see PAGE_STRATEGIES.
+        The image order within a page comes from `sort_by`, else the recipe `page_sort_by`,
+        else the strategy default.
+
+        :param strategy: name in PAGE_STRATEGIES, e.g. "lotPerPage" or "tempPerPage"
+        :type strategy: str
+        :param sort_by: columns ordering the images of a page, defaults to None
+        :type sort_by: list, optional
+        :return: page_by, sort_by, name_by column lists
+        :rtype: dict
+        """
+        if strategy not in PAGE_STRATEGIES:
+            raise ValueError(f"unknown page strategy {strategy}; {list(PAGE_STRATEGIES)}")
+        spec = dict(PAGE_STRATEGIES[strategy])
+        if not sort_by and "page_sort_by" in self.cfg:
+            sort_by = self.cfg["page_sort_by"]
+        if sort_by:
+            spec["sort_by"] = list(sort_by)
+        missing = [x for x in spec["page_by"] + spec["sort_by"] if x not in self.df]
+        if missing:
+            raise ValueError(f"sort keys not in file table; {missing}")
+        return spec
+
+    def sort_pages(self, strategy: str, sort_by: list = None) -> pd.DataFrame:
+        """File table sorted so that the rows of a page are contiguous and in order"""
+        spec = self.page_strategy(strategy, sort_by)
+        return self.df.sort_values(
+            spec["page_by"] + spec["sort_by"], kind="stable"
+        ).reset_index(drop=True)
 
-    def construct_lotPerPage(self) -> dict[str, list]:
+    def iter_pages(
+        self, strategy: str = "lotPerPage", sort_by: list = None
+    ) -> Iterator[tuple[str, list]]:
+        """
+        Yields page name and ordered filepaths of every page, lazily.
+        One sort and one groupby pass over the file table, empty groups are never produced.
+
+        :param strategy: name in PAGE_STRATEGIES, defaults to "lotPerPage"
+        :type strategy: str, optional
+        :param sort_by: columns ordering the images of a page, defaults to None
+        :type sort_by: list, optional
+        :raises ValueError: two pages with the same name
+        :yield: page name, e.g. "25C::PROD::LOT01", and its filepaths
+        :rtype: Iterator[tuple[str, list]]
+        """
+        with perf.span("group"):
+            spec = self.page_strategy(strategy, sort_by)
+            df = self.sort_pages(strategy, spec["sort_by"])
+            if df.empty:
+                return
+            codes = df.groupby(spec["page_by"], sort=False, observed=True).ngroup()
+            starts = np.flatnonzero(np.diff(codes.to_numpy(), prepend=-1))
+            ends = np.append(starts[1:], len(df))
+            filepaths = df["filepath"].to_numpy()
+            names = df[spec["name_by"]].to_numpy()
+        seen = set()
+        for start, end in zip(starts, ends):
+            name = "::".join(str(x) for x in names[start])
+            if name in seen:
+                raise ValueError(f"duplicate page name {name}; check name_by of {strategy}")
+            seen.add(name)
+            yield name, filepaths[start:end].tolist()
+
+    def construct_lotPerPage(self, sort_by: list = None) -> dict[str, list]:
 
         data = DataInfo()
-        folders = self.df.foldername.unique()
-        lot_ids = self.df.lot_id.unique()
-
-        for folder in folders:
-            for lot_id in lot_ids:
-                df = (
-                    self.df[(self.df.foldername == folder) & (self.df.lot_id == lot_id)]
-                    .sort_values("wafer_id")
-                    .reset_index(drop=True)
-                )
-                data.add_data({f"{folder}::{lot_id}": df.filepath.to_list()})
-
+        for name, filepaths in self.iter_pages("lotPerPage", sort_by):
+            data.add_data({name: filepaths})
         return data
 
     def construct_singleWafers(self) -> pd.DataFrame:
-        df = self.df.pivot(
-            index=["lot_id", "wafer_id"], columns="foldername", values="filepath"
-        )
+        with perf.span("group"):
+            df = self.df.pivot(
+                index=["lot_id", "wafer_id"], columns="foldername", values="filepath"
+            )
         if self.cfg['debug_mode']:
             outname = f"construct_singleWafers-{get_time()}.csv"
             outpath = self.cfg['user_folders']['outf02'] / outname
@@ -113,19 +288,16 @@ class FileManager:
             index=["lot_id"],
             values="filename",
             aggfunc="count",
+            observed=True,
         )
         print(df)
         return f"{text_descr}: \n{df.to_string()}"
 
     def sortby_lotPerPage(self):
-        return self.df.sort_values(
-            ["product_id", "temp", "lot_id", "wafer_id"]
-        ).reset_index(drop=True)
+        return self.sort_pages("lotPerPage")
 
     def sortby_tempPerPage(self):
-        return self.df.sort_values(
-            ["product_id", "lot_id", "wafer_id", "temp"]
-        ).reset_index(drop=True)
+        return self.sort_pages("tempPerPage")
 
 
 def run(cfg: dict) -> list[pd.DataFrame]:
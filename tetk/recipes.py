@@ -0,0 +1,259 @@
+import copy
+import threading
+from collections import namedtuple
+from pathlib import Path
+from types import MappingProxyType
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    # PyYAML built without libyaml
+    from yaml import SafeLoader
+
+
+EMU_PER_CM = 360000
+EMU_PER_PT = 12700
+
+NUMBER = (int, float)
+# expected types of the recipe keys, keys not listed here are not checked
+SCHEMA = {
+    "recipe_version": (str, int, float),
+    "project_name": str,
+    "folders_key_names": MappingProxyType,
+    "files_key_names": MappingProxyType,
+    "debug_mode": bool,
+    "original_image_size": tuple,
+    "crop_coords": tuple,
+    "coor_x_origin": NUMBER,
+    "coor_y_origin": NUMBER,
+    "wafer_id_text_size": NUMBER,
+    "wafer_id_text_y_offset": NUMBER,
+    "wafer_id_textbox_width_cm": NUMBER,
+    "wafer_id_textbox_height_cm": NUMBER,
+    "wafer_id_legend_x_offset_cm": NUMBER,
+    "wafer_id_legend_y_offset_cm": NUMBER,
+    "wafer_id_single_size_width_cm": NUMBER,
+    "wafer_id_single_txtbox_loc_offset_x_cm": NUMBER,
+    "wafer_id_single_txtbox_loc_offset_y_cm": NUMBER,
+    "wafer_id_single_txtbox_text_size_pt": NUMBER,
+    "scan_workers": int,
+    "preprocess_workers": int,
+    "crop_cache_max_mb": NUMBER,
+    "template_cache_max_mb": NUMBER,
+    "embed_dpi": NUMBER,
+    "embed_png_colors": int,
+    "grid_lot": MappingProxyType,
+    "grid_single": MappingProxyType,
+    "numeric_fields": tuple,
+}
+SEQUENCE_LENGTHS = {"original_image_size": 2, "crop_coords": 4}
+
+Recipe = namedtuple("Recipe", "name path mtime_ns size values")
+Recipe.__doc__ = "Parsed and validated recipe, `values` is read only, see `thaw()`"
+
+# slide grid of a recipe, sizes in EMU, 0 cols or rows means as many as needed,
+# fit shrinks cells and gutters to the free area of the slide
+Grid = namedtuple("Grid", "cols rows cell_width cell_height gutter_x gutter_y fit")
+
+# slide layout constants of a recipe, in EMU, crop_box in pixels
+Layout = namedtuple(
+    "Layout",
+    [
+        "x_origin",
+        "y_origin",
+        "title_y_offset",
+        "title_width",
+        "title_height",
+        "title_font_size",
+        "legend_x_offset",
+        "legend_y_offset",
+        "single_width",
+        "single_legend_x_offset",
+        "single_legend_y_offset",
+        "single_legend_font_size",
+        "crop_box",
+        "grid_lot",
+        "grid_single",
+    ],
+)
+LAYOUT_KEYS = [
+    "coor_x_origin",
+    "coor_y_origin",
+    "wafer_id_text_y_offset",
+    "wafer_id_textbox_width_cm",
+    "wafer_id_textbox_height_cm",
+    "wafer_id_text_size",
+    "wafer_id_legend_x_offset_cm",
+    "wafer_id_legend_y_offset_cm",
+    "wafer_id_single_size_width_cm",
+    "wafer_id_single_txtbox_loc_offset_x_cm",
+    "wafer_id_single_txtbox_loc_offset_y_cm",
+    "wafer_id_single_txtbox_text_size_pt",
+    "crop_coords",
+    "grid_lot",
+    "grid_single",
+]
+
+
+def cm(value: float) -> int:
+    return round(value * EMU_PER_CM)
+
+
+def pt(value: float) -> int:
+    return round(value * EMU_PER_PT)
+
+
+def compile_grid(spec, cell_width_cm: float) -> Grid:
+    """
+    Grid in EMU from its recipe spec, e.g.
+    `{cols: 0, rows: 0, cell_width_cm: 3, gutter_x_cm: 0, gutter_y_cm: 0, fit: True}`
+
+    :param spec: grid spec of the recipe, missing keys take the defaults
+    :type spec: dict
+    :param cell_width_cm: cell width if the spec has none
+    :type cell_width_cm: float
+    :return: grid
+    :rtype: Grid
+    """
+    width_cm = spec["cell_width_cm"] if "cell_width_cm" in spec else cell_width_cm
+    height_cm = spec["cell_height_cm"] if "cell_height_cm" in spec else width_cm
+    return Grid(
+        cols=int(spec["cols"] if "cols" in spec else 0),
+        rows=int(spec["rows"] if "rows" in spec else 0),
+        cell_width=cm(width_cm),
+        cell_height=cm(height_cm),
+        gutter_x=cm(spec["gutter_x_cm"] if "gutter_x_cm" in spec else 0),
+        gutter_y=cm(spec["gutter_y_cm"] if "gutter_y_cm" in spec else 0),
+        fit=bool(spec["fit"] if "fit" in spec else True),
+    )
+
+
+def compile_layout(values) -> Layout:
+    """
+    Converts the layout keys of a configuration to EMU, once per recipe
+    instead of through `Cm()` for every shape
+
+    :param values: configuration or recipe values
+    :type values: dict
+    :return: layout constants
+    :rtype: Layout
+    """
+    return Layout(
+        x_origin=cm(values["coor_x_origin"]),
+        y_origin=cm(values["coor_y_origin"]),
+        title_y_offset=cm(values["wafer_id_text_y_offset"]),
+        title_width=cm(values["wafer_id_textbox_width_cm"]),
+        title_height=cm(values["wafer_id_textbox_height_cm"]),
+        title_font_size=pt(values["wafer_id_text_size"]),
+        legend_x_offset=cm(values["wafer_id_legend_x_offset_cm"]),
+        legend_y_offset=cm(values["wafer_id_legend_y_offset_cm"]),
+        single_width=cm(values["wafer_id_single_size_width_cm"]),
+        single_legend_x_offset=cm(values["wafer_id_single_txtbox_loc_offset_x_cm"]),
+        single_legend_y_offset=cm(values["wafer_id_single_txtbox_loc_offset_y_cm"]),
+        single_legend_font_size=pt(values["wafer_id_single_txtbox_text_size_pt"]),
+        crop_box=tuple(int(x) for x in values["crop_coords"]),
+        grid_lot=compile_grid(
+            values["grid_lot"] if "grid_lot" in values else {}, cell_width_cm=3
+        ),
+        grid_single=compile_grid(
+            values["grid_single"] if "grid_single" in values else {"cols": 4},
+            cell_width_cm=values["wafer_id_single_size_width_cm"],
+        ),
+    )
+
+
+def load_yaml(filepath: Path):
+    """Parses a .yml with the libyaml loader when available"""
+    with open(filepath, "rb") as stream:
+        return yaml.load(stream, Loader=SafeLoader)
+
+
+def freeze(value):
+    """Read only copy, dicts become mapping proxies and lists tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(x) for x in value)
+    return value
+
+
+def thaw(value):
+    """Mutable copy of a frozen value, for the configuration dict"""
+    if isinstance(value, MappingProxyType):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(x) for x in value]
+    return copy.copy(value)
+
+
+def validate(values, name: str = "recipe"):
+    """
+    Checks the types of the keys listed in SCHEMA
+
+    :param values: frozen recipe values
+    :type values: MappingProxyType
+    :raises ValueError: every invalid key of the recipe
+    """
+    errors = []
+    for key, types in SCHEMA.items():
+        if key not in values or values[key] is None:
+            continue
+        value = values[key]
+        if not isinstance(value, types) or (isinstance(value, bool) and types is NUMBER):
+            errors.append(f"{key}={value!r} is not {types}")
+        elif key in SEQUENCE_LENGTHS and len(value) != SEQUENCE_LENGTHS[key]:
+            errors.append(f"{key}={value!r} needs {SEQUENCE_LENGTHS[key]} values")
+    if not errors and all(key in values for key in LAYOUT_KEYS[:-2]):
+        try:
+            compile_layout(values)
+        except (TypeError, ValueError) as e:
+            errors.append(f"layout; {e}")
+    if errors:
+        raise ValueError(f"invalid {name}; " + "; ".join(errors))
+
+
+class RecipeRegistry:
+    """
+    Recipes parsed once and cached by path, file mtime and size.
+    Switching between recipes that did not change costs a stat call, no parsing.
+    """
+
+    def __init__(self):
+        self.recipes = {}
+        self.parsed = 0
+        self._lock = threading.Lock()
+
+    def get(self, filepath: Path) -> Recipe:
+        """
+        Parsed and validated recipe, parsed again only if the file changed
+
+        :param filepath: recipe .yml
+        :type filepath: pathlib.Path
+        :raises ValueError: invalid recipe
+        :return: recipe
+        :rtype: Recipe
+        """
+        filepath = Path(filepath).resolve()
+        stat = filepath.stat()
+        with self._lock:
+            recipe = self.recipes.get(filepath)
+            if recipe is not None and (recipe.mtime_ns, recipe.size) == (
+                stat.st_mtime_ns,
+                stat.st_size,
+            ):
+                return recipe
+            values = freeze(load_yaml(filepath) or {})
+            validate(values, filepath.name)
+            recipe = Recipe(filepath.name, filepath, stat.st_mtime_ns, stat.st_size, values)
+            self.recipes[filepath] = recipe
+            self.parsed += 1
+            return recipe
+
+    def clear(self):
+        with self._lock:
+            self.recipes.clear()
+
+
+REGISTRY = RecipeRegistry()
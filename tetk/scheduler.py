@@ -0,0 +1,208 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from fileindex import get_file_index
+from cli import load_recipe, set_output, build
+
+
+DeckJob = namedtuple(
+    "DeckJob",
+    "name input_folder recipe template layout include output",
+    defaults=("config.yml", None, "run", None, None),
+)
+DeckJob.__doc__ = """
+One deck to build.
+
+:param name: job name, also the deck file name if `output` is not given
+:param input_folder: folder of images
+:param recipe: recipe .yml, a path or a name in the user configuration folder
+:param template: .pptx template, defaults to the recipe's ppt_template1
+:param layout: "run", "lot" or "single", see cli.LAYOUTS
+:param include: glob pattern on the file names selecting the subset of images
+:param output: output .pptx, defaults to <name>.pptx in the output folder
+"""
+
+JobResult = namedtuple("JobResult", "name status outpath attempts elapsed_s error")
+
+
+def check_names(jobs: list[DeckJob]):
+    """
+    :raises ValueError: job names that are not unique, they name the decks and results
+    """
+    names = [job.name for job in jobs]
+    duplicates = sorted({x for x in names if names.count(x) > 1})
+    if duplicates:
+        raise ValueError(f"job names must be unique; {duplicates}")
+
+
+def run_job(job: DeckJob) -> Path:
+    """
+    Builds the deck of one job, in a pool worker.
+    Images are prepared in the worker itself, the jobs are the parallelism.
+    Prepared images are shared between jobs through the crop cache on disk.
+
+    :return: path of the saved deck
+    :rtype: pathlib.Path
+    """
+    cfg = load_recipe(job.recipe)
+    cfg["preprocess_workers"] = 1
+    # refreshed once by DeckScheduler.refresh_index, workers never write the index
+    cfg["file_index_read_only"] = True
+    if job.template is not None:
+        cfg.user_files["ppt_template1"] = Path(job.template)
+    outname = set_output(cfg, Path(job.output or f"{job.name}.pptx"))
+    build(
+        cfg,
+        Path(job.input_folder).resolve(),
+        layout=job.layout,
+        outname=outname,
+        include=job.include,
+    )
+    return cfg.user_folders["outf01"] / outname
+
+
+class DeckScheduler:
+    """
+    Builds many decks concurrently on a process pool.
+    A failed job is retried on its own, the other jobs carry on.
+    A worker process that dies breaks the pool, the pool is then restarted
+    and the jobs it was running are retried.
+
+    :param cfg: configuration, uses `job_workers`, `job_retries`
+    :type cfg: config.Config
+    :param on_progress: called in this process as on_progress(job, status, info)
+        with status one of queued, running, retry, done, failed; defaults to None
+    :type on_progress: callable, optional
+    """
+
+    def __init__(self, cfg: dict, on_progress=None):
+        self.cfg = cfg
+        self.log = cfg.log
+        workers = int(cfg["job_workers"]) if "job_workers" in cfg else 0
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.retries = int(cfg["job_retries"]) if "job_retries" in cfg else 1
+        self.on_progress = on_progress
+
+    def report(self, job: DeckJob, status: str, info: str = ""):
+        self.log.info(f"job {job.name}: {status} {info}".rstrip())
+        if self.on_progress is not None:
+            self.on_progress(job, status, info)
+
+    def refresh_index(self, jobs: list[DeckJob]):
+        # brought up to date once here, the workers open it read only
+        index = get_file_index(self.cfg)
+        if index is None:
+            return
+        for folder in {Path(job.input_folder).resolve() for job in jobs}:
+            index.refresh(folder)
+
+    def run(self, jobs: list[DeckJob]) -> list[JobResult]:
+        """
+        Builds all jobs
+
+        :param jobs: decks to build, job names must be unique
+        :type jobs: list[DeckJob]
+        :return: result of every job, in the order of `jobs`
+        :rtype: list[JobResult]
+        """
+        check_names(jobs)
+        names = [job.name for job in jobs]
+        self.refresh_index(jobs)
+
+        results = {}
+        attempts = {job.name: 0 for job in jobs}
+        started = {}
+        queue = list(jobs)
+        for job in queue:
+            self.report(job, "queued")
+
+        pool_size = min(self.workers, len(jobs) or 1)
+        pool = ProcessPoolExecutor(max_workers=pool_size)
+        running = {}
+        try:
+            while queue or running:
+                while queue and len(running) < pool_size:
+                    job = queue.pop(0)
+                    attempts[job.name] += 1
+                    started[job.name] = time.perf_counter()
+                    running[pool.submit(run_job, job)] = job
+                    self.report(job, "running", f"attempt {attempts[job.name]}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job = running.pop(future)
+                    elapsed = round(time.perf_counter() - started[job.name], 3)
+                    try:
+                        outpath = future.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        error = f"worker died; {e}"
+                    except Exception as e:
+                        error = f"{e.__class__.__name__}: {e}"
+                    else:
+                        results[job.name] = JobResult(
+                            job.name, "done", outpath, attempts[job.name], elapsed, None
+                        )
+                        self.report(job, "done", f"{elapsed}s //{outpath.name}")
+                        continue
+
+                    if attempts[job.name] <= self.retries:
+                        self.report(job, "retry", error)
+                        queue.append(job)
+                    else:
+                        results[job.name] = JobResult(
+                            job.name, "failed", None, attempts[job.name], elapsed, error
+                        )
+                        self.report(job, "failed", error)
+
+                if broken:
+                    # every other future of a broken pool fails too, requeue them
+                    for future, job in running.items():
+                        future.cancel()
+                        self.report(job, "retry", "pool restarted")
+                        queue.append(job)
+                    running.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = ProcessPoolExecutor(max_workers=pool_size)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+        failed = sum(x.status == "failed" for x in results.values())
+        self.log.info(f"{len(jobs) - failed}/{len(jobs)} decks built, {failed} failed")
+        return [results[name] for name in names]
+
+
+def load_jobs(jobs_file: Path) -> list[DeckJob]:
+    """
+    Reads a job list from a .yml file, a list of mappings with the DeckJob fields.
+    Relative paths are relative to the job list file,
+    a recipe not found there is looked up by name in the user configuration folder.
+
+    :param jobs_file: path to the job list
+    :type jobs_file: pathlib.Path
+    :raises ValueError: job names that are not unique
+    :return: jobs
+    :rtype: list[DeckJob]
+    """
+    import yaml
+
+    with open(jobs_file, "r") as stream:
+        data = yaml.safe_load(stream)
+    if isinstance(data, dict):
+        data = data.get("jobs", [])
+    jobs = []
+    root = Path(jobs_file).parent
+    for item in data:
+        for key in ["input_folder", "template", "output"]:
+            if item.get(key) is not None:
+                item[key] = root / item[key]
+        if item.get("recipe") is not None and (root / item["recipe"]).is_file():
+            item["recipe"] = str(root / item["recipe"])
+        jobs.append(DeckJob(**item))
+    check_names(jobs)
+    return jobs
@@ -0,0 +1,134 @@
+import math
+import itertools
+import functools
+
+import numpy as np
+
+from recipes import Grid
+
+
+def grid_shape(n: int, grid: Grid) -> tuple[int, int]:
+    """
+    Columns and rows of a page of `n` slots, 0 in the grid spec means as many as needed
+
+    :return: cols, rows
+    :rtype: tuple[int, int]
+    """
+    n = max(n, 1)
+    if grid.cols:
+        cols = grid.cols
+    elif grid.rows:
+        cols = math.ceil(n / grid.rows)
+    else:
+        cols = math.ceil(math.sqrt(n))
+    rows = grid.rows or math.ceil(n / cols)
+    return cols, rows
+
+
+def fit_scale(cols: int, rows: int, grid: Grid, area: tuple) -> float:
+    """Factor shrinking cells and gutters so that the grid fits `area` (width, height), never above 1"""
+    if not grid.fit or area is None:
+        return 1.0
+    needed_x = cols * grid.cell_width + (cols - 1) * grid.gutter_x
+    needed_y = rows * grid.cell_height + (rows - 1) * grid.gutter_y
+    area_x, area_y = area
+    scale = 1.0
+    if needed_x > 0 and area_x > 0:
+        scale = min(scale, area_x / needed_x)
+    if needed_y > 0 and area_y > 0:
+        scale = min(scale, area_y / needed_y)
+    return scale
+
+
+@functools.lru_cache(maxsize=256)
+def grid_slots(
+    n: int, grid: Grid, origin: tuple, area: tuple = None, order: str = "row"
+) -> np.ndarray:
+    """
+    Positions of the `n` slots of a page, computed in one pass.
+    Pages with the same number of slots share the result, it is cached and read only.
+
+    :param n: number of slots
+    :type n: int
+    :param grid: compiled grid spec, sizes in EMU
+    :type grid: recipes.Grid
+    :param origin: (left, top) of the first slot in EMU
+    :type origin: tuple
+    :param area: (width, height) in EMU the grid is shrunk into if `grid.fit`, defaults to None
+    :type area: tuple, optional
+    :param order: "row" fills the slots row by row, "col" column by column
+    :type order: str, optional
+    :return: int64 array of shape (n, 4), left, top, width, height of each slot
+    :rtype: numpy.ndarray
+    """
+    cols, rows = grid_shape(n, grid)
+    scale = fit_scale(cols, rows, grid, area)
+    width = grid.cell_width * scale
+    height = grid.cell_height * scale
+    pitch_x = width + grid.gutter_x * scale
+    pitch_y = height + grid.gutter_y * scale
+
+    index = np.arange(n)
+    if order == "row":
+        row, col = np.divmod(index, cols)
+    elif order == "col":
+        col, row = np.divmod(index, rows)
+    else:
+        raise ValueError(f"unknown slot order {order}; row, col")
+
+    slots = np.empty((n, 4), dtype=np.int64)
+    slots[:, 0] = origin[0] + np.rint(col * pitch_x)
+    slots[:, 1] = origin[1] + np.rint(row * pitch_y)
+    slots[:, 2] = round(width)
+    slots[:, 3] = round(height)
+    slots.flags.writeable = False
+    return slots
+
+
+def page_capacity(grid: Grid, area: tuple, min_cell: int = 0, max_slots: int = 0) -> int:
+    """
+    Most slots a page takes, so that cells shrunk to fit stay at least `min_cell` wide
+    and there are at most `max_slots`
+
+    :param grid: compiled grid spec, sizes in EMU
+    :type grid: recipes.Grid
+    :param area: (width, height) in EMU the grid is fitted into
+    :type area: tuple
+    :param min_cell: minimum cell width in EMU, defaults to 0 (no minimum)
+    :type min_cell: int, optional
+    :param max_slots: maximum slots per page, defaults to 0 (no maximum)
+    :type max_slots: int, optional
+    :return: slots per page, 0 if unlimited
+    :rtype: int
+    """
+    capacity = max_slots
+    if min_cell and grid.fit and grid.cell_width >= min_cell:
+        # fitted cells only shrink as pages grow, the largest page still wide enough
+        def wide_enough(n):
+            cols, rows = grid_shape(n, grid)
+            return grid.cell_width * fit_scale(cols, rows, grid, area) >= min_cell
+
+        low, high = 1, 1
+        while wide_enough(high) and high < 1_000_000:
+            low, high = high, high * 2
+        while low < high - 1:
+            mid = (low + high) // 2
+            low, high = (mid, high) if wide_enough(mid) else (low, mid)
+        capacity = min(capacity, low) if capacity else low
+    return capacity
+
+
+def iter_pages(items, page_size: int):
+    """
+    Pages of `items` as lists of at most `page_size`, built one at a time
+    so that a huge group is never split up front. `page_size` 0 gives one page.
+    """
+    items = iter(items)
+    if not page_size:
+        yield list(items)
+        return
+    while True:
+        page = list(itertools.islice(items, page_size))
+        if not page:
+            return
+        yield page
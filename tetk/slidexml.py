@@ -0,0 +1,91 @@
+from xml.sax.saxutils import escape
+
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls, qn
+
+
+# same markup as python-pptx CT_Picture.new_pic, without the whitespace
+PIC_TEMPLATE = (
+    "<p:pic>"
+    "<p:nvPicPr>"
+    '<p:cNvPr id="%d" name="Picture %d" descr="%s"/>'
+    '<p:cNvPicPr><a:picLocks noChangeAspect="1"/></p:cNvPicPr>'
+    "<p:nvPr/>"
+    "</p:nvPicPr>"
+    "<p:blipFill>"
+    '<a:blip r:embed="%s"/>'
+    "<a:stretch><a:fillRect/></a:stretch>"
+    "</p:blipFill>"
+    "<p:spPr>"
+    '<a:xfrm><a:off x="%d" y="%d"/><a:ext cx="%d" cy="%d"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom>'
+    "</p:spPr>"
+    "</p:pic>"
+)
+SPTREE_OPEN = "<p:spTree %s>" % nsdecls("a", "p", "r")
+SPTREE_CLOSE = "</p:spTree>"
+
+
+class PictureBatch:
+    """
+    Pictures of one slide, emitted together instead of one `add_picture` each.
+    `emit` renders all `p:pic` elements from one template into a single XML string,
+    parses it once and moves the elements into the slide's shape tree.
+    The shape ids and the image relationships are allocated in the same pass,
+    python-pptx scans every id of the slide and every relationship for each picture.
+
+    :param slide: slide the pictures are placed on
+    :type slide: pptx.slide.Slide
+    """
+
+    def __init__(self, slide):
+        self.slide = slide
+        self.pictures = []
+
+    def __len__(self):
+        return len(self.pictures)
+
+    def add(self, image_part, left: int, top: int, width: int, height: int):
+        """Queues a picture, sizes in EMU, nothing is added to the slide before `emit`"""
+        self.pictures.append((image_part, left, top, width, height))
+
+    def emit(self) -> int:
+        """
+        Adds the queued pictures to the slide, in the order they were queued
+
+        :return: number of pictures added
+        :rtype: int
+        """
+        if not self.pictures:
+            return 0
+        rels = self.slide.part.rels
+        rIds = {}
+        for rId in rels:
+            rel = rels[rId]
+            if rel.reltype == RT.IMAGE and not rel.is_external:
+                rIds[rel.target_part] = rId
+
+        spTree = self.slide.shapes._spTree
+        shape_id = spTree.max_shape_id
+        fragments = []
+        for image_part, left, top, width, height in self.pictures:
+            rId = rIds.get(image_part)
+            if rId is None:
+                rId = rIds[image_part] = rels._add_relationship(RT.IMAGE, image_part)
+            shape_id += 1
+            descr = escape(image_part.desc, {'"': "&quot;"})
+            fragments.append(
+                PIC_TEMPLATE
+                % (shape_id, shape_id - 1, descr, rId, left, top, width, height)
+            )
+        pics = list(parse_xml(SPTREE_OPEN + "".join(fragments) + SPTREE_CLOSE))
+
+        extLst = spTree.find(qn("p:extLst"))
+        if extLst is None:
+            spTree.extend(pics)
+        else:
+            for pic in pics:
+                extLst.addprevious(pic)
+        self.pictures = []
+        return len(pics)
@@ -0,0 +1,88 @@
+import copy
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pptx
+
+
+class TemplateCache:
+    """
+    Parsed .pptx templates, kept per process and keyed by path and mtime.
+    Every `get` hands out a deep copy of the parsed presentation: the XML trees are copied,
+    media blobs are immutable bytes and shared, so a copy costs a fraction of a reparse.
+    Least recently used templates are dropped once the templates on disk add up to `max_mb`.
+
+    :param max_mb: memory bound, sum of the template file sizes in MB, defaults to 256
+    :type max_mb: float, optional
+    """
+
+    def __init__(self, max_mb: float = 256):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, filepath: Path):
+        """
+        Independent copy of the parsed template, parsed again only if the file changed
+
+        :param filepath: .pptx template
+        :type filepath: pathlib.Path
+        :return: presentation, free to modify
+        :rtype: pptx.presentation.Presentation
+        """
+        stat = filepath.stat()
+        key = (str(Path(filepath).resolve()), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                master, _ = entry
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                master = pptx.Presentation(filepath)
+                self._store(key, master, stat.st_size)
+            return copy.deepcopy(master)
+
+    def _store(self, key: tuple, master, nbytes: int):
+        # an edited template replaces its older version
+        for old_key in [x for x in self.entries if x[0] == key[0]]:
+            self._drop(old_key)
+        self.entries[key] = (master, nbytes)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._drop(next(iter(self.entries)))
+
+    def _drop(self, key: tuple):
+        _, nbytes = self.entries.pop(key)
+        self.total_bytes -= nbytes
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+TEMPLATE_CACHE = TemplateCache()
+
+
+def load_template(filepath: Path, max_mb: float = None):
+    """
+    Presentation from the process wide template cache
+
+    :param filepath: .pptx template
+    :type filepath: pathlib.Path
+    :param max_mb: updates the memory bound of the cache, 0 bypasses the cache, defaults to None
+    :type max_mb: float, optional
+    :return: presentation, free to modify
+    :rtype: pptx.presentation.Presentation
+    """
+    if max_mb is not None:
+        if not max_mb:
+            return pptx.Presentation(filepath)
+        TEMPLATE_CACHE.max_bytes = int(max_mb * 1024 * 1024)
+    return TEMPLATE_CACHE.get(filepath)
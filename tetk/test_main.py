@@ -1,14 +1,47 @@
 import os
+from pathlib import Path
 import shutil
-from main import update_config_details
+import tempfile
+import atexit
+from main import update_config_details, coalesce_log_records
 import config
 import commons as cf
 from makeppt import PptManager
-from utils import PathFinder
+from imageprep import ImagePreprocessor, CropCache
+from imageprobe import probe_image
+import PIL.Image
+import pptx
+import zipfile
+from utils import PathFinder, scan_files
+from fileindex import FileIndex
+from reader import parse_filenames, FileManager
+import pandas as pd
+import pytest
+import cli
+
+# the working dir is bootstrapped under ~/Documents, keep the suite out of the real home
+TEST_HOME = Path(tempfile.mkdtemp(prefix="tetk-pytest-"))
+os.environ["HOME"] = os.environ["USERPROFILE"] = str(TEST_HOME)
+atexit.register(shutil.rmtree, TEST_HOME, ignore_errors=True)
 
 cfg = config.Config(config_filename="config.yml", hard_reset=False)
 cfg = update_config_details(cfg)
 log = cfg.log
+USER_WD = cfg.user_wd
+
+
+@pytest.fixture(autouse=True)
+def user_folders(tmp_path_factory, monkeypatch):
+    """Moves the working dir of every test into its own home, configs built by the CLI follow it"""
+    home = tmp_path_factory.mktemp("home")
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("USERPROFILE", str(home))
+    user_wd = home / USER_WD.relative_to(TEST_HOME)
+    monkeypatch.setattr(cfg, "user_wd", user_wd)
+    for key, folder in list(cfg.user_folders.items()):
+        folder = user_wd / folder.relative_to(USER_WD)
+        folder.mkdir(parents=True, exist_ok=True)
+        monkeypatch.setitem(cfg.user_folders, key, folder)
 
 
 def test_detect_images():
@@ -34,11 +67,739 @@ def test_detect_images():
 
 
 def test_main_production_run():
+    for img in PathFinder().get_image_files(".png"):
+        shutil.copy(img, cfg.user_folders["inpf01"])
     ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
     fm = PathFinder(cwd=cfg.user_folders["inpf01"])
     imgs = fm.get_image_files(".png")
+    assert len(imgs) > 0
     ppt.insert_images_wafersPerLot("images", imgs)
-    ppt.save_ppt(outname=f"pytest-results-{cf.get_time()}.pptx")
-    for img in imgs:
-        log.error(f"removing {img.name}")
-        os.remove(img)
+    outpath = ppt.save_ppt(outname=f"pytest-results-{cf.get_time()}.pptx")
+    assert outpath.parent == cfg.user_folders["outf01"]
+
+
+def test_preprocess_is_deterministic(monkeypatch):
+    imgs = PathFinder().get_image_files(".png")
+    results = []
+    for n in [1, 4]:
+        monkeypatch.setitem(cfg, "preprocess_workers", n)
+        preprocessor = ImagePreprocessor(cfg)
+        results.append([(x.filepath, x.blob) for x in preprocessor.run(imgs)])
+        preprocessor.close()
+    assert len(results[0]) == len(imgs)
+    assert results[0] == results[1]
+
+
+def test_crop_cache_is_non_destructive(tmp_path):
+    imgs = PathFinder().get_image_files(".png")[:4]
+    sources = [img.read_bytes() for img in imgs]
+    preprocessor = ImagePreprocessor(cfg)
+    preprocessor.cache = CropCache(log, tmp_path, max_mb=64)
+    # the example images need no crop, untouched images are not copied into the cache
+    passthrough = preprocessor.run(imgs, width_px=100_000)
+    assert [x.blob for x in passthrough] == sources
+    assert not list(tmp_path.glob("*.img")) and preprocessor.cache.total_bytes == 0
+    first = preprocessor.run(imgs, width_px=50)
+    second = preprocessor.run(imgs, width_px=50)
+    preprocessor.close()
+    assert [img.read_bytes() for img in imgs] == sources
+    assert preprocessor.cache.total_bytes == sum(x.stat().st_size for x in tmp_path.glob("*.img"))
+    # leftovers of dead workers are removed, recent writes are left to finish
+    old_tmp, new_tmp = tmp_path / "a.1.tmp", tmp_path / "b.2.tmp"
+    old_tmp.write_bytes(b"x")
+    new_tmp.write_bytes(b"x")
+    os.utime(old_tmp, (0, 0))
+    preprocessor.cache.evict()
+    assert not old_tmp.exists() and new_tmp.exists()
+    assert len(list(tmp_path.glob("*.img"))) == len({x.blob for x in first})
+    assert all(x.cache_hit for x in second)
+    assert [x.blob for x in first] == [x.blob for x in second]
+
+
+def test_probe_image_matches_pil():
+    for img in PathFinder().get_image_files(".png"):
+        info = probe_image(img)
+        with PIL.Image.open(img) as pil_img:
+            assert (info.width, info.height) == pil_img.size
+
+
+def test_streaming_output_matches_in_memory():
+    imgs = PathFinder().get_image_files(".png")
+    outnames = [f"pytest-memory-{cf.get_time()}.pptx", f"pytest-stream-{cf.get_time()}.pptx"]
+    for outname, streaming in zip(outnames, [False, True]):
+        ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+        if streaming:
+            ppt.open_stream(outname)
+        ppt.insert_images_wafersPerLot("first", imgs[:8])
+        # the same wafer twice on one page
+        ppt.insert_images_wafersPerLot("second", imgs[8:] + imgs[8:9])
+        if streaming:
+            assert not ppt.prepared
+        ppt.save_ppt(outname=outname)
+
+    outpaths = [cfg.user_folders["outf01"] / x for x in outnames]
+    zips = [zipfile.ZipFile(x) for x in outpaths]
+    assert sorted(zips[0].namelist()) == sorted(zips[1].namelist())
+    for name in zips[0].namelist():
+        if name.startswith("ppt/media/"):
+            assert zips[0].read(name) == zips[1].read(name)
+    decks = [pptx.Presentation(x) for x in outpaths]
+    assert len(decks[1].slides) == 2
+    pics = [
+        [sum(x.shape_type == 13 for x in slide.shapes) for slide in deck.slides]
+        for deck in decks
+    ]
+    assert pics[0] == pics[1] == [8, len(imgs) - 7]
+
+
+def test_embed_dpi_downsamples_images(monkeypatch):
+    imgs = PathFinder().get_image_files(".png")[:2]
+    monkeypatch.setitem(cfg, "embed_dpi", 96)
+    ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+    ppt.preprocessor.cache = None
+    ppt.prepare_images(imgs, fixed_width=3)
+    width_px = ppt.preprocessor.width_px(pptx.util.Cm(3))
+    ppt.preprocessor.close()
+    assert width_px == 114
+    assert all(x.info.width == width_px for x in ppt.prepared.values())
+
+
+def test_lot_images_are_prepared_once_at_the_slot_width(tmp_path, monkeypatch):
+    import benchmark
+
+    benchmark.make_corpus(tmp_path, 60)
+    monkeypatch.setitem(cfg, "embed_dpi", 96)
+    monkeypatch.setitem(cfg, "max_images_per_slide", 25)
+    fmgr = FileManager(cfg, tmp_path)
+    data = fmgr.construct_lotPerPage()
+    ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+    ppt.preprocessor.cache = None
+    ppt.prepare_lots(data)
+    prepared = len(ppt.prepared)
+    requested = []
+    monkeypatch.setattr(
+        ppt.preprocessor, "run", lambda imgpaths, **x: requested.extend(imgpaths) or []
+    )
+    for name, imgpaths in data.items():
+        ppt.insert_images_wafersPerLot(name, imgpaths)
+    ppt.preprocessor.close()
+    # the pages find every image prepared at their slot width
+    assert prepared == 60 and not requested
+    widths = {x.info.width for x in ppt.prepared.values()}
+    assert widths == {ppt.preprocessor.width_px(int(ppt.lot_slots(25)[0, 2]))}
+
+
+def test_incremental_output_rebuilds_changed_slides(tmp_path):
+    for img in PathFinder().get_image_files(".png")[:6]:
+        shutil.copy(img, tmp_path)
+    imgs = sorted(tmp_path.glob("*.png"))
+    outname = f"pytest-incremental-{cf.get_time()}.pptx"
+
+    def build():
+        ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+        ppt.open_incremental(outname)
+        ppt.insert_images_wafersPerLot("first", imgs[:3])
+        ppt.insert_images_wafersPerLot("second", imgs[3:])
+        ppt.save_ppt()
+        return ppt
+
+    first = build()
+    shutil.copy(imgs[0], imgs[4])
+    second = build()
+    slide_ids = [x["slide_id"] for x in second.manifest.slides]
+    assert slide_ids[0] == first.manifest.slides[0]["slide_id"]
+    assert slide_ids[1] != first.manifest.slides[1]["slide_id"]
+    deck = pptx.Presentation(cfg.user_folders["outf01"] / outname)
+    assert [x.slide_id for x in deck.slides] == slide_ids
+
+
+def test_incremental_rerun_retitles_a_lot_growing_onto_a_new_page(tmp_path, monkeypatch):
+    import benchmark
+
+    benchmark.make_corpus(tmp_path / "input", 30)
+    imgs = sorted((tmp_path / "input").rglob("*.png"))
+    monkeypatch.setitem(cfg, "max_images_per_slide", 25)
+
+    def build(images):
+        ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+        ppt.open_incremental("incremental.pptx")
+        ppt.insert_images_wafersPerLot("lot", images)
+        ppt.save_ppt()
+        deck = pptx.Presentation(cfg.user_folders["outf01"] / "incremental.pptx")
+        return [
+            [x.text_frame.text for x in slide.shapes if x.has_text_frame and x.text_frame.text][0]
+            for slide in list(deck.slides)[-len(ppt.manifest.slides) :]
+        ]
+
+    titles = build(imgs[:25])
+    assert len(titles) == 1 and titles[0].startswith("lot: 25")
+    titles = build(imgs)
+    assert len(titles) == 2
+    assert titles[0].startswith("lot (1/2): 25") and titles[1].startswith("lot (2/2): 5")
+
+
+def test_scan_files_matches_rglob(tmp_path):
+    for folder in ["25C", "110C", "110C/nested"]:
+        (tmp_path / folder).mkdir(parents=True)
+        for name in ["a_1.png", "b_2.PNG", "skip_3.png", "notes.txt"]:
+            (tmp_path / folder / name).write_bytes(b"x")
+    table = scan_files(tmp_path, exts=(".png",), exclude="skip_*", workers=4)
+    found = sorted(Path(f, n) for f, n in zip(table.folder, table.name))
+    expected = sorted(
+        x for x in tmp_path.rglob("*") if x.suffix.lower() == ".png" and "skip" not in x.name
+    )
+    assert found == expected
+    assert table == scan_files(tmp_path, exts=(".png",), exclude="skip_*", workers=1)
+
+
+def test_scan_skips_dangling_links_and_keeps_the_exclude_keyword_rule(tmp_path):
+    for name in ["a_1.png", "skip_2.png", "Skip_3.png", "lot[1]_4.png", "c.skip.png"]:
+        (tmp_path / name).write_bytes(b"x")
+    (tmp_path / "dangling.png").symlink_to(tmp_path / "missing.png")
+    table = scan_files(tmp_path, workers=4)
+    assert "dangling.png" not in table.name and len(table.name) == 5
+    finder = PathFinder(cwd=tmp_path)
+    assert [x.name for x in finder.get_image_files(exclude_kw="skip")] == [
+        "Skip_3.png",
+        "a_1.png",
+        "lot[1]_4.png",
+    ]
+    assert "lot[1]_4.png" not in [x.name for x in finder.get_image_files(exclude_kw="[1]")]
+
+
+def test_file_index_tracks_changes(tmp_path):
+    root = tmp_path / "input"
+    for folder in ["25C", "110C"]:
+        (root / folder).mkdir(parents=True)
+        (root / folder / "a_1.png").write_bytes(b"x")
+    index = FileIndex(log, tmp_path / "index.sqlite", workers=2)
+    assert index.scan(root) == scan_files(root)
+
+    shutil.rmtree(root / "25C")
+    (root / "110C" / "b_2.png").write_bytes(b"x")
+    (root / "110C" / "nested").mkdir()
+    (root / "110C" / "nested" / "c_3.png").write_bytes(b"x")
+    assert index.scan(root) == scan_files(root)
+
+
+def test_read_only_file_index_never_writes(tmp_path):
+    import sqlite3
+
+    root = tmp_path / "input"
+    root.mkdir()
+    (root / "a_1.png").write_bytes(b"x")
+    db_path = tmp_path / "index.sqlite"
+    FileIndex(log, db_path).refresh(root)
+    (root / "b_2.png").write_bytes(b"x")
+    os.utime(root, (0, 0))
+    snapshot = db_path.read_bytes()
+
+    reader = FileIndex(log, db_path, read_only=True)
+    assert reader.scan(root).name == ["a_1.png"]
+    assert db_path.read_bytes() == snapshot
+    with pytest.raises(sqlite3.OperationalError):
+        reader.refresh(root)
+
+
+def test_parse_filenames_types_and_unmatched():
+    df = pd.DataFrame(
+        {
+            "foldername": ["25C", "25C", "-40C", "notes"],
+            "filename": ["P1_LOT1_W-05.png", "P1_LOT2_W-12.png", "P1_LOT1_W-05.png", "x.png"],
+        }
+    )
+    parsed, unmatched = parse_filenames(
+        df, cfg["filename_pattern"], cfg["foldername_pattern"]
+    )
+    assert unmatched["filename"].to_list() == ["x.png"]
+    assert parsed["wafer_id"].to_list() == [5, 12, 5]
+    assert parsed["temp"].to_list() == [25, 25, -40]
+    assert parsed["lot_id"].dtype == "category"
+    assert pd.api.types.is_integer_dtype(parsed["temp"])
+
+
+def test_parse_filenames_keeps_ids_as_text_and_anchors_patterns():
+    df = pd.DataFrame(
+        {
+            "foldername": ["25C", "25C", "25C"],
+            "filename": ["P1_00123_W-05.png", "007_00124_W-06.png", "x.png"],
+        }
+    )
+    parsed, _ = parse_filenames(df, cfg["filename_pattern"], cfg["foldername_pattern"])
+    assert parsed["lot_id"].to_list() == ["00123", "00124"]
+    assert parsed["product_id"].to_list() == ["P1", "007"]
+    assert parsed["wafer_id"].to_list() == [5, 6]
+    df = pd.DataFrame(
+        {"foldername": ["25C", "25C"], "filename": ["LOT1_W-05.png", "x_LOT1_W-05.png"]}
+    )
+    parsed, unmatched = parse_filenames(df, r"(?P<lot_id>LOT\d+)_W-(?P<wafer_id>\d+)")
+    assert parsed["filename"].to_list() == ["LOT1_W-05.png"]
+    assert unmatched["filename"].to_list() == ["x_LOT1_W-05.png"]
+
+
+def test_lot_pages_group_and_sort(tmp_path):
+    for folder, names in {
+        "25C": ["P1_LOT2_W-03.png", "P1_LOT1_W-12.png", "P1_LOT1_W-05.png"],
+        "-40C": ["P1_LOT1_W-07.png"],
+    }.items():
+        (tmp_path / folder).mkdir()
+        for name in names:
+            (tmp_path / folder / name).write_bytes(b"x")
+    fmgr = FileManager(cfg, tmp_path)
+    data = fmgr.construct_lotPerPage()
+    assert list(data) == ["-40C::P1::LOT1", "25C::P1::LOT1", "25C::P1::LOT2"]
+    assert [x.name for x in data["25C::P1::LOT1"]] == ["P1_LOT1_W-05.png", "P1_LOT1_W-12.png"]
+    pages = dict(fmgr.iter_pages("tempPerPage"))
+    assert [x.parent.name for x in pages["P1::LOT1::5"]] == ["25C"]
+    assert len(fmgr.sortby_tempPerPage()) == 4
+
+
+def test_products_sharing_a_lot_id_get_their_own_pages(tmp_path):
+    (tmp_path / "25C").mkdir()
+    for name in ["P1_LOT1_W-01.png", "P1_LOT1_W-02.png", "P2_LOT1_W-01.png"]:
+        (tmp_path / "25C" / name).write_bytes(b"x")
+    fmgr = FileManager(cfg, tmp_path)
+    data = fmgr.construct_lotPerPage()
+    assert {k: len(v) for k, v in data.items()} == {"25C::P1::LOT1": 2, "25C::P2::LOT1": 1}
+    assert len(dict(fmgr.iter_pages("tempPerPage"))) == 3
+
+
+def test_cli_build_exit_codes(tmp_path):
+    resources = Path(__file__).parent.parent / "resources"
+    outpath = tmp_path / "deck.pptx"
+    assert cli.main(["build", str(resources), "-o", str(outpath), "-w", "1"]) == 0
+    assert len(pptx.Presentation(outpath).slides) > 0
+    # sample names do not match filename_pattern
+    assert cli.main(["build", str(resources), "-l", "lot", "-o", str(outpath)]) == 1
+    with pytest.raises(SystemExit) as e:
+        cli.main(["build", str(tmp_path / "missing")])
+    assert e.value.code == 2
+
+
+def test_scheduler_retries_failed_job_only(tmp_path, monkeypatch):
+    from scheduler import DeckScheduler, DeckJob
+
+    resources = Path(__file__).parent.parent / "resources"
+    jobs = [
+        DeckJob("deck_a", resources, output=tmp_path / "a.pptx"),
+        DeckJob("deck_b", resources, include="0*.png", output=tmp_path / "b.pptx"),
+        DeckJob("deck_bad", resources, template=tmp_path / "missing.pptx"),
+    ]
+    events = []
+    monkeypatch.setitem(cfg, "job_workers", 2)
+    monkeypatch.setitem(cfg, "job_retries", 1)
+    results = DeckScheduler(cfg, on_progress=lambda *x: events.append(x[:2])).run(jobs)
+
+    assert [x.status for x in results] == ["done", "done", "failed"]
+    assert results[2].attempts == 2
+    assert (jobs[2], "retry") in events
+    assert len(pptx.Presentation(tmp_path / "a.pptx").slides) > 0
+    assert len(pptx.Presentation(tmp_path / "b.pptx").slides) > 0
+
+
+def test_load_jobs_resolves_recipes_and_rejects_duplicates(tmp_path, capsys):
+    from scheduler import load_jobs
+
+    shutil.copy(cfg.user_config_file, tmp_path / "local.yml")
+    jobs_file = tmp_path / "jobs.yml"
+    jobs_file.write_text(
+        "jobs:\n"
+        "  - {name: a, input_folder: images, recipe: local.yml}\n"
+        "  - {name: b, input_folder: images, recipe: anotherRecipe.yml}\n"
+    )
+    jobs = load_jobs(jobs_file)
+    assert Path(jobs[0].recipe) == tmp_path / "local.yml"
+    assert jobs[1].recipe == "anotherRecipe.yml"
+
+    jobs_file.write_text(
+        "jobs:\n  - {name: a, input_folder: images}\n  - {name: a, input_folder: images}\n"
+    )
+    assert cli.main(["batch", str(jobs_file)]) == cli.EXIT_USAGE
+    assert "job names must be unique; ['a']" in capsys.readouterr().err
+
+
+def test_template_cache_hands_out_copies(tmp_path):
+    from templatecache import TemplateCache
+
+    template = tmp_path / "template.pptx"
+    shutil.copy(cfg.user_files["ppt_template1"], template)
+    cache = TemplateCache(max_mb=64)
+    first, second = cache.get(template), cache.get(template)
+    first.slides.add_slide(first.slide_layouts[0])
+    assert len(second.slides) == len(first.slides) - 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    first.save(tmp_path / "out.pptx")
+    assert len(pptx.Presentation(tmp_path / "out.pptx").slides) == len(first.slides)
+
+    os.utime(template, ns=(0, 0))
+    cache.get(template)
+    assert cache.misses == 2 and len(cache.entries) == 1
+    cache.max_bytes = 0
+    cache.get(shutil.copy(template, tmp_path / "other.pptx"))
+    assert len(cache.entries) == 1
+
+
+def test_repeated_images_are_stored_once():
+    imgs = PathFinder().get_image_files(".png")
+    outname = f"pytest-dedup-{cf.get_time()}.pptx"
+    ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+    ppt.insert_images_wafersPerLot("lot", imgs)
+    ppt.insert_images_wafersPerLot("again", imgs)
+    ppt.save_ppt(outname=outname)
+
+    assert ppt.bytes_placed == 2 * ppt.bytes_embedded
+    with zipfile.ZipFile(cfg.user_folders["outf01"] / outname) as z:
+        media = [x for x in z.namelist() if x.startswith("ppt/media/image")]
+    assert len(media) == len(ppt.image_parts.parts)
+    assert len(pptx.Presentation(cfg.user_folders["outf01"] / outname).slides) == 2
+
+
+def test_job_runner_cancels_queued_and_running_jobs():
+    import threading
+    from jobrunner import JobRunner, JobCancelled
+
+    runner = JobRunner(log)
+    started, release = threading.Event(), threading.Event()
+
+    def build(job):
+        ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+        ppt.open_stream(f"pytest-cancel-{cf.get_time()}.pptx")
+        ppt.job = job
+        imgs = PathFinder().get_image_files(".png")
+        job.set_total(len(imgs))
+        ppt.insert_images_wafersPerLot("first", imgs[:4])
+        started.set()
+        release.wait(5)
+        try:
+            ppt.insert_images_wafersPerLot("second", imgs[4:])
+        except JobCancelled:
+            assert not ppt.preprocessor._pool and ppt.stream is None
+            raise
+
+    first = runner.submit("first", build)
+    second = runner.submit("second", build)
+    started.wait(5)
+    runner.cancel_all()
+    release.set()
+    runner._pool.shutdown(wait=True)
+
+    events = runner.drain_events()
+    states = {job.name: [x.state for x in events if x.job_id == job.id] for job in [first, second]}
+    assert states["first"][-1] == "cancelled"
+    assert states["second"] == ["queued", "cancelled"]
+    assert max(x.done for x in events if x.job_id == first.id) == 4
+
+
+def test_failed_gui_build_is_reported_failed():
+    from types import SimpleNamespace
+    from jobrunner import JobRunner
+    import main
+
+    def detect_images():
+        raise FileNotFoundError("input folder missing")
+
+    root = SimpleNamespace(
+        log=log,
+        cfg=cfg,
+        functional_buttons={"detect_images": SimpleNamespace(invoke=detect_images)},
+    )
+    frame = SimpleNamespace(root=root, log=log, cfg=cfg)
+    runner = JobRunner(log)
+    for name in ["prod_run", "prod_single_plots", "prod_lot_id_plots"]:
+        runner.submit(name, getattr(main.MainFrameAA, name), frame)
+    runner._pool.shutdown(wait=True)
+    events = runner.drain_events()
+    assert [x.state for x in events if x.state in ("done", "failed")] == ["failed"] * 3
+    assert all("input folder missing" in x.message for x in events if x.state == "failed")
+
+
+def test_console_queue_handler_counts_every_drop():
+    import logging
+    import queue
+    import threading
+    from main import QueueHandler
+
+    handler = QueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord("tetk", logging.INFO, __file__, 0, "msg", None, None)
+    taken = []
+
+    def produce():
+        for _ in range(2000):
+            handler.emit(record)
+
+    threads = [threading.Thread(target=produce) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(x.is_alive() for x in threads):
+        taken.append(handler.take_dropped())
+    taken.append(handler.take_dropped())
+    assert sum(taken) == 4 * 2000 - 1 and handler.dropped == 0
+
+
+def test_console_coalesces_log_bursts():
+    import logging
+
+    def record(level, i):
+        return logging.LogRecord("tetk", level, __file__, 0, f"msg{i}", None, None)
+
+    records = [record(logging.DEBUG, i) for i in range(1000)]
+    records[10] = record(logging.ERROR, 10)
+    kept, suppressed = coalesce_log_records(records, max_batch=100)
+    assert len(kept) == 100 and suppressed == 900
+    assert kept[0].getMessage() == "msg10"
+    assert kept[-1].getMessage() == "msg999"
+    assert coalesce_log_records(records[:5], max_batch=100) == (records[:5], 0)
+
+
+def test_file_logging_is_queued_and_flushed_at_exit():
+    import sys
+    import subprocess
+
+    # own process, under pytest the root logger has handlers and setup_logger skips
+    script = (
+        "import config; cfg = config.Config(); "
+        "assert cfg.log.handlers[0].listener.running; "
+        "[cfg.log.info(f'flush-check {i}') for i in range(3000)]; "
+        "print(cfg.user_logfile)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+    )
+    logfile = Path(result.stdout.strip().splitlines()[-1])
+    assert "flush-check 2999" in logfile.read_text()
+
+
+def test_classtimer_returns_result_and_writes_perf_report(monkeypatch):
+    import json
+
+    class Runner:
+        def __init__(self):
+            self.log, self.cfg = log, cfg
+
+        @cf.classtimer
+        def prod_example(self):
+            ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+            ppt.insert_images_wafersPerLot("images", PathFinder().get_image_files(".png"))
+            return ppt.save_ppt(f"pytest-perf-{cf.get_time()}.pptx")
+
+    monkeypatch.setitem(cfg, "debug_mode", True)
+    outpath = Runner().prod_example()
+    assert outpath.is_file()
+
+    reports = sorted(cfg.user_folders["outf02"].glob("prod_example-perf-*.json"))
+    report = json.loads(reports[-1].read_text())
+    spans = {x["name"]: x for x in report["spans"]}
+    assert spans["prod_example/add_picture"]["count"] == report["counters"]["images_added"]
+    assert "prod_example/save/zip_write" in spans and "prod_example/scan" in spans
+    assert report["counters"]["bytes_written"] == outpath.stat().st_size
+
+
+def test_benchmark_appends_results(tmp_path):
+    import json
+
+    outpath = tmp_path / "bench.jsonl"
+    argv = ["bench", "-s", "60", "--corpus-dir", str(tmp_path), "-o", str(outpath)]
+    assert cli.main(argv) == 0
+    assert cli.main(argv) == 0
+    results = [json.loads(x) for x in outpath.read_text().splitlines()]
+    assert len(results) == 2
+    assert results[0]["n_found"] == 60 and results[0]["n_pages"] == 4
+    assert {"pathfinder_s", "filetable_s", "group_s", "insert_s", "save_s"} <= set(
+        results[0]["stages"]
+    )
+    assert results[0]["counters"]["images_added"] == 60
+
+
+def test_profile_mode_writes_prof_and_allocations(tmp_path):
+    import pstats
+
+    outpath = tmp_path / "deck.pptx"
+    resources = PathFinder().get_image_files(".png")[0].parent
+    argv = ["build", str(resources), "-o", str(outpath), "-w", "1", "--profile"]
+    assert cli.main(argv) == 0
+
+    folder = cfg.user_folders["outf02"]
+    prof_path = sorted(folder.glob("build_run-profile-*.prof"))[-1]
+    stats = pstats.Stats(str(prof_path))
+    assert any(func[2] == "insert_images_wafersPerLot" for func in stats.stats)
+    alloc = prof_path.with_name(f"{prof_path.stem}-alloc.txt").read_text()
+    assert alloc.startswith("peak traced memory")
+    assert prof_path.with_name(f"{prof_path.stem}-stats.txt").is_file()
+
+
+def test_gui_startup_defers_heavy_imports(tmp_path):
+    import benchmark
+
+    result = benchmark.startup(repeats=1)
+    assert result["heavy_modules"] == []
+    assert any(x["module"] == "main" for x in result["top_imports"])
+    assert cf.refresh_version_file(log, tmp_path, tmp_path) is True
+    assert cf.refresh_version_file(log, tmp_path, tmp_path) is False
+    # an empty file, e.g. fresh from a checkout, is newer than the refs but still stale
+    repo_path = Path(__file__).parent.parent
+    version_file = tmp_path / "version.txt"
+    version_file.write_text("")
+    os.utime(version_file, (2**31, 2**31))
+    assert cf.refresh_version_file(log, tmp_path, repo_path) is True
+    assert version_file.read_text().strip()
+
+
+def test_recipe_registry_caches_and_validates(tmp_path):
+    from recipes import RecipeRegistry
+
+    registry = RecipeRegistry()
+    recipe_path = tmp_path / "recipe.yml"
+    shutil.copy(cfg.bundle_config_file, recipe_path)
+    recipe = registry.get(recipe_path)
+    assert registry.get(recipe_path) is recipe and registry.parsed == 1
+    with pytest.raises(TypeError):
+        recipe.values["crop_coords"] = [0, 0, 1, 1]
+
+    text = recipe_path.read_text().replace("coor_x_origin: 1.67", "coor_x_origin: 2")
+    recipe_path.write_text(text)
+    os.utime(recipe_path, ns=(recipe.mtime_ns + 10**9, recipe.mtime_ns + 10**9))
+    assert registry.get(recipe_path).values["coor_x_origin"] == 2
+    assert registry.parsed == 2
+
+    recipe_path.write_text(text.replace("crop_coords: [0, 55, 422, 477]", "crop_coords: [0, 55]"))
+    with pytest.raises(ValueError, match="crop_coords"):
+        registry.get(recipe_path)
+
+    layout_cfg = config.Config(hard_reset=False)
+    layout_cfg.apply_recipe(layout_cfg.user_config_folder / "anotherRecipe.yml")
+    assert layout_cfg["project_name"] == "Eviyos_WaferMapsPPT"
+    assert layout_cfg.layout.x_origin == round(layout_cfg["coor_x_origin"] * 360000)
+    layout_cfg["coor_x_origin"] = 5
+    assert layout_cfg.layout.x_origin == 5 * 360000
+    assert "_layout" not in layout_cfg and "recipe" not in layout_cfg.copy()
+
+
+def test_switching_recipes_drops_keys_of_the_previous_recipe(tmp_path):
+    switch_cfg = config.Config(hard_reset=False)
+    bundle = switch_cfg.load_yaml(switch_cfg.bundle_config_file)
+    recipe_a = tmp_path / "a.yml"
+    recipe_a.write_text(
+        "page_sort_by: [temp, wafer_id]\npicture_backend: pptx\nonly_in_a: 1\n"
+    )
+    recipe_b = tmp_path / "b.yml"
+    recipe_b.write_text("project_name: recipe_b\n")
+    switch_cfg.apply_recipe(recipe_a)
+    assert switch_cfg["picture_backend"] == "pptx" and switch_cfg["only_in_a"] == 1
+    switch_cfg.apply_recipe(recipe_b)
+    assert "only_in_a" not in switch_cfg
+    assert switch_cfg["page_sort_by"] == bundle["page_sort_by"]
+    assert switch_cfg["picture_backend"] == bundle["picture_backend"]
+    assert switch_cfg["project_name"] == "recipe_b"
+    assert switch_cfg.user_folders and switch_cfg.log
+
+
+def test_grid_slots_fit_the_slide():
+    from recipes import Grid
+    from slidegrid import grid_slots
+
+    grid = Grid(cols=0, rows=0, cell_width=1080000, cell_height=1080000, gutter_x=0, gutter_y=0, fit=True)
+    slots = grid_slots(25, grid, (0, 0), (5400000, 5400000), "row")
+    assert slots.shape == (25, 4) and slots[:, 2].max() == 1080000
+    assert grid_slots(25, grid, (0, 0), (5400000, 5400000), "row") is slots
+    assert slots[6].tolist() == [1080000, 1080000, 1080000, 1080000]
+
+    # 400 images shrink to fit, columns then rows
+    slots = grid_slots(400, grid, (100, 200), (5400000, 5400000), "col")
+    assert (slots[:, 0] + slots[:, 2]).max() <= 100 + 5400000
+    assert (slots[:, 1] + slots[:, 3]).max() <= 200 + 5400000
+    assert slots[1, 0] == 100 and slots[1, 1] > 200
+
+
+def test_single_wafer_compare_with_three_folders(tmp_path):
+    import benchmark
+
+    benchmark.make_corpus(tmp_path / "input", 8)
+    shutil.copytree(tmp_path / "input" / "25C", tmp_path / "input" / "-40C")
+    fmgr = FileManager(cfg, tmp_path / "input")
+    ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+    n_slides = len(ppt.root.slides)
+    ppt.insert_images_singleWaferCompare(df=fmgr.construct_singleWafers())
+    slides = list(ppt.root.slides)[n_slides:]
+    # 4 wafers, 3 folders, 4 columns per slide
+    assert len(slides) == 1
+    pics = [x for x in slides[0].shapes if x.shape_type == 13]
+    assert len(pics) == 12
+    assert len({(x.left, x.top) for x in pics}) == 12
+    assert max(x.left + x.width for x in pics) <= ppt.root.slide_width
+
+
+def test_large_group_is_paginated(tmp_path, monkeypatch):
+    import benchmark
+
+    benchmark.make_corpus(tmp_path, 60)
+    imgs = sorted(tmp_path.rglob("*.png"))
+    monkeypatch.setitem(cfg, "max_images_per_slide", 25)
+    ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+    n_slides = len(ppt.root.slides)
+    ppt.insert_images_wafersPerLot("lot", imgs)
+    ppt.insert_images_wafersPerLot("stream", iter(imgs[:30]))
+    slides = list(ppt.root.slides)[n_slides:]
+    pics = [sum(x.shape_type == 13 for x in slide.shapes) for slide in slides]
+    assert pics == [25, 25, 10, 25, 5]
+    titles = [
+        [x.text_frame.text for x in slide.shapes if x.has_text_frame and x.text_frame.text][0]
+        for slide in slides
+    ]
+    assert titles[0].startswith("lot (1/3): 25") and titles[2].startswith("lot (3/3): 10")
+    assert titles[3].startswith("stream: 25") and titles[4].startswith("stream (cont. 2): 5")
+
+
+def test_xml_picture_backend_matches_python_pptx(tmp_path, monkeypatch):
+    import io
+    import benchmark
+
+    benchmark.make_corpus(tmp_path, 30)
+    imgs = sorted(tmp_path.rglob("*.png"))
+    decks = {}
+    for name in ["xml", "pptx"]:
+        monkeypatch.setitem(cfg, "picture_backend", name)
+        ppt = PptManager(cfg, cfg.user_files["ppt_template1"])
+        n_slides = len(ppt.root.slides)
+        ppt.insert_images_wafersPerLot("lot", imgs + imgs[:5])
+        stream = io.BytesIO()
+        ppt.root.save(stream)
+        slide = list(pptx.Presentation(stream).slides)[n_slides]
+        decks[name] = [
+            (x.shape_id, x.name, x.left, x.top, x.width, x.height, x.image.sha1)
+            for x in slide.shapes
+            if x.shape_type == 13
+        ]
+    assert len(decks["xml"]) == 35
+    assert decks["xml"] == decks["pptx"]
+
+
+def test_png_and_jpeg_are_embedded_without_pil(tmp_path, monkeypatch):
+    import makeppt
+    from imageprep import prepare_image
+
+    png = PathFinder().get_image_files(".png")[0]
+    jpeg = tmp_path / "wafer.jpg"
+    with PIL.Image.open(png) as img:
+        img.convert("RGB").save(jpeg, dpi=(150, 150))
+    index = makeppt.ImagePartIndex(
+        PptManager(cfg, cfg.user_files["ppt_template1"]).root.part.package
+    )
+
+    def no_pil(*args, **kwargs):
+        raise AssertionError("PIL must not open PNG or JPEG inputs")
+
+    monkeypatch.setattr(PIL.Image, "open", no_pil)
+    monkeypatch.setattr(makeppt.Image, "from_blob", no_pil)
+    for imgpath, ext, content_type in [
+        (png, "png", "image/png"),
+        (jpeg, "jpg", "image/jpeg"),
+    ]:
+        prepared = prepare_image(imgpath, original_size=(1, 1))
+        assert prepared.blob == imgpath.read_bytes() and prepared.info.ext == ext
+        part, is_new = index.get_or_add(prepared.blob, imgpath.name, prepared.info)
+        assert is_new and part.partname.ext == ext and part.content_type == content_type
+    assert prepare_image(jpeg, original_size=(1, 1)).info.dpi == (150, 150)
@@ -1,9 +1,136 @@
+import os
+import re
+import fnmatch
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-import pandas as pd
+
+import perf
+
+
+FileTable = namedtuple("FileTable", "folder name size mtime")
+
+
+def _compile_globs(patterns):
+    if not patterns:
+        return None
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    return re.compile("|".join(fnmatch.translate(os.path.normcase(x)) for x in patterns))
+
+
+def _name_filter(exts=(), include=None, exclude=None):
+    """
+    Returns a predicate on file names, for the extension and include/exclude glob filters
+
+    :param exts: file extensions to keep, case insensitive, empty keeps all files
+    :type exts: tuple, optional
+    :param include: glob pattern(s) on the file name that must match, defaults to None
+    :type include: str | list, optional
+    :param exclude: glob pattern(s) on the file name that must not match, defaults to None
+    :type exclude: str | list, optional
+    """
+    if isinstance(exts, str):
+        exts = (exts,)
+    exts = tuple(x.lower() for x in exts)
+    include, exclude = _compile_globs(include), _compile_globs(exclude)
+
+    def keep(name: str) -> bool:
+        if exts and not name.lower().endswith(exts):
+            return False
+        name = os.path.normcase(name)
+        if include is not None and not include.match(name):
+            return False
+        if exclude is not None and exclude.match(name):
+            return False
+        return True
+
+    return keep
+
+
+def _scan_dir(folder: str, keep=None):
+    files, subdirs = [], []
+    try:
+        entries = os.scandir(folder)
+    except (PermissionError, FileNotFoundError):
+        return files, subdirs
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+                continue
+            if keep is not None and not keep(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # dangling symlink, or removed since the listing
+                continue
+            files.append((folder, entry.name, stat.st_size, stat.st_mtime))
+    return files, subdirs
+
+
+def scan_files(
+    root: Path, exts=(".png",), include=None, exclude=None, workers: int = 8
+) -> FileTable:
+    """
+    Recursive file scan on os.scandir, subdirectories are walked concurrently on a thread pool.
+    Extensions and include/exclude globs are matched in the same pass,
+    results are sorted by folder and name so the order does not depend on the scheduling.
+
+    :param root: folder to scan
+    :type root: pathlib.Path
+    :param exts: file extensions to keep, case insensitive, empty keeps all files
+    :type exts: tuple, optional
+    :param include: glob pattern(s) on the file name that must match, defaults to None
+    :type include: str | list, optional
+    :param exclude: glob pattern(s) on the file name that must not match, defaults to None
+    :type exclude: str | list, optional
+    :param workers: number of scanning threads, defaults to 8
+    :type workers: int, optional
+    :return: parallel lists of folder, name, size, mtime
+    :rtype: FileTable
+    """
+    with perf.span("scan"):
+        rows = _scan_rows(root, _name_filter(exts, include, exclude), workers)
+    perf.count("files_scanned", len(rows))
+    if not rows:
+        return FileTable([], [], [], [])
+    return FileTable(*(list(col) for col in zip(*rows)))
+
+
+def _scan_rows(root: Path, keep, workers: int) -> list[tuple]:
+    rows = []
+    if workers <= 1:
+        pending = [str(root)]
+        while pending:
+            files, subdirs = _scan_dir(pending.pop(), keep)
+            rows.extend(files)
+            pending.extend(subdirs)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {pool.submit(_scan_dir, str(root), keep)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    rows.extend(files)
+                    for subdir in subdirs:
+                        pending.add(pool.submit(_scan_dir, subdir, keep))
+    rows.sort()
+    return rows
 
 
 class PathFinder:
-    def __init__(self, cwd: None | Path = None, resources_name: str = "resources"):
+    def __init__(
+        self,
+        cwd: None | Path = None,
+        resources_name: str = "resources",
+        scan_workers: int = 8,
+        index=None,
+    ):
+        self.scan_workers = scan_workers
+        self.index = index
         match cwd:
             case None:
                 self.cwd = Path(__file__).parent.parent
@@ -21,17 +148,28 @@ class PathFinder:
             raise NotADirectoryError(f"{path=}")
         return path
 
+    def scan(self, file_ext: str = ".png", exclude_kw: str = "") -> FileTable:
+        if self.index is not None:
+            table = self.index.scan(self.resources_path, exts=(file_ext,))
+        else:
+            table = scan_files(
+                self.resources_path, exts=(file_ext,), workers=self.scan_workers
+            )
+        if not exclude_kw:
+            return table
+        # plain case-sensitive substring of the file stem, not a glob
+        rows = [
+            row for row in zip(*table) if exclude_kw not in os.path.splitext(row[1])[0]
+        ]
+        if not rows:
+            return FileTable([], [], [], [])
+        return FileTable(*(list(col) for col in zip(*rows)))
+
     def get_image_files(
         self, file_ext: str = ".png", exclude_kw: str = ""
     ) -> list[Path]:
-        if exclude_kw:
-            imgs = [
-                fp
-                for fp in self.resources_path.rglob(f"*{file_ext}")
-                if exclude_kw not in fp.stem
-            ]
-        else:
-            imgs = [fp for fp in self.resources_path.rglob(f"*{file_ext}")]
+        table = self.scan(file_ext, exclude_kw)
+        imgs = [Path(folder, name) for folder, name in zip(table.folder, table.name)]
 
         if not imgs:
             raise FileNotFoundError(f"no files found {file_ext=}")
@@ -43,10 +181,19 @@ class PathFinder:
             output_dir.mkdir()
         return output_dir
 
-    def get_filetable(self) -> pd.DataFrame:
-        df = pd.DataFrame(pd.Series(self.get_image_files()), columns=["filepath"])
-        df["foldername"] = df["filepath"].apply(lambda x: x.parent.name)
-        return df
+    def get_filetable(self) -> "pd.DataFrame":
+        # pandas is imported here, the GUI imports this module before the window shows
+        import pandas as pd
+
+        table = self.scan()
+        if not table.name:
+            raise FileNotFoundError("no files found")
+        return pd.DataFrame(
+            {
+                "filepath": [Path(f, n) for f, n in zip(table.folder, table.name)],
+                "foldername": [os.path.basename(f) for f in table.folder],
+            }
+        )
 
 
 def main():